@@ -0,0 +1,113 @@
+import asyncio
+import logging
+from collections import defaultdict
+from aiogram import Bot
+from aiogram.types import InputMediaDocument
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096
+CAPTION_LIMIT = 1024
+MEDIA_GROUP_LIMIT = 10
+
+DIGEST_TITLES = {
+    "receipt": "📄 Новые чеки",
+    "expired": "⛔️ Истёкшие доступы",
+    "callback_error": "⚠️ Ошибки обработчиков кнопок",
+}
+
+
+class AdminEvent:
+    __slots__ = ("text", "document")
+
+    def __init__(self, text: str, document: str = None):
+        self.text = text
+        self.document = document
+
+
+# Уведомления администратору копятся по типам и уходят сводками раз в flush_interval,
+# документы — медиагруппами. Срочные события отправляются сразу.
+class AdminNotifier:
+    def __init__(self, bot: Bot, admin_id: int, flush_interval: float = 60.0):
+        self.bot = bot
+        self.admin_id = admin_id
+        self.flush_interval = flush_interval
+        self._buffers = defaultdict(list)
+        self._task = None
+        self._urgent_tasks = set()
+
+    def notify(self, kind: str, text: str, document: str = None, urgent: bool = False):
+        if urgent:
+            task = asyncio.create_task(self._send_event(AdminEvent(text, document)))
+            self._urgent_tasks.add(task)
+            task.add_done_callback(self._urgent_tasks.discard)
+            return
+        self._buffers[kind].append(AdminEvent(text, document))
+
+    async def _send_event(self, event: AdminEvent):
+        try:
+            if event.document:
+                await self.bot.send_document(self.admin_id, event.document, caption=event.text[:CAPTION_LIMIT])
+            else:
+                await self.bot.send_message(self.admin_id, event.text[:MESSAGE_LIMIT])
+        except Exception as e:
+            logger.warning("Не удалось отправить уведомление администратору: %s", e)
+
+    async def _send_documents(self, events):
+        for start in range(0, len(events), MEDIA_GROUP_LIMIT):
+            batch = events[start:start + MEDIA_GROUP_LIMIT]
+            if len(batch) == 1:
+                await self._send_event(batch[0])
+                continue
+            media = [
+                InputMediaDocument(media=event.document, caption=event.text[:CAPTION_LIMIT])
+                for event in batch
+            ]
+            try:
+                await self.bot.send_media_group(self.admin_id, media)
+            except Exception as e:
+                logger.warning("Не удалось отправить медиагруппу администратору: %s", e)
+
+    async def _send_digest(self, kind: str, events):
+        title = DIGEST_TITLES.get(kind, kind)
+        header = f"{title} ({len(events)}):"
+        chunk = header
+        for event in events:
+            line = "\n\n" + event.text
+            if len(chunk) + len(line) > MESSAGE_LIMIT:
+                await self._send_event(AdminEvent(chunk))
+                chunk = header
+            chunk += line
+        await self._send_event(AdminEvent(chunk))
+
+    async def flush(self):
+        buffers, self._buffers = self._buffers, defaultdict(list)
+        for kind, events in buffers.items():
+            documents = [event for event in events if event.document]
+            texts = [event for event in events if not event.document]
+            if documents:
+                await self._send_documents(documents)
+            if len(texts) == 1:
+                await self._send_event(texts[0])
+            elif texts:
+                await self._send_digest(kind, texts)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Ошибка отправки сводки администратору: %s", e)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._urgent_tasks:
+            await asyncio.gather(*self._urgent_tasks, return_exceptions=True)
+        await self.flush()
@@ -0,0 +1,83 @@
+import asyncio
+import hashlib
+import logging
+import os
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+from database import get_static_asset_file_id, save_static_asset_file_id, delete_static_asset
+
+logger = logging.getLogger(__name__)
+
+
+# Локальные файлы загружаются в Telegram один раз, дальше отправляются по file_id.
+# file_id хранится по SHA-256 содержимого, поэтому изменённый файл загрузится заново.
+class StaticAssets:
+    def __init__(self):
+        self._hashes = {}
+        self._file_ids = {}
+        self._locks = {}
+
+    def content_hash(self, path: str) -> str:
+        stat = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+        sha256 = digest.hexdigest()
+        self._hashes[path] = (stat.st_mtime_ns, stat.st_size, sha256)
+        return sha256
+
+    async def _lookup(self, sha256: str):
+        file_id = self._file_ids.get(sha256)
+        if file_id:
+            return file_id
+        try:
+            file_id = await get_static_asset_file_id(sha256)
+        except Exception as e:
+            logger.warning("Не удалось получить file_id для %s: %s", sha256, e)
+            return None
+        if file_id:
+            self._file_ids[sha256] = file_id
+        return file_id
+
+    async def _forget(self, sha256: str):
+        self._file_ids.pop(sha256, None)
+        try:
+            await delete_static_asset(sha256)
+        except Exception as e:
+            logger.warning("Не удалось удалить file_id для %s: %s", sha256, e)
+
+    async def send_document(self, bot: Bot, chat_id: int, path: str, **kwargs):
+        sha256 = self.content_hash(path)
+
+        file_id = await self._lookup(sha256)
+        if file_id:
+            try:
+                return await bot.send_document(chat_id, file_id, **kwargs)
+            except TelegramBadRequest as e:
+                logger.warning("file_id для %s больше не действителен: %s", path, e)
+                await self._forget(sha256)
+
+        lock = self._locks.setdefault(sha256, asyncio.Lock())
+        async with lock:
+            file_id = self._file_ids.get(sha256)
+            if file_id:
+                return await bot.send_document(chat_id, file_id, **kwargs)
+
+            message = await bot.send_document(chat_id, FSInputFile(path), **kwargs)
+            file_id = message.document.file_id
+            self._file_ids[sha256] = file_id
+            try:
+                await save_static_asset_file_id(sha256, path, file_id)
+            except Exception as e:
+                logger.warning("Не удалось сохранить file_id для %s: %s", path, e)
+            logger.info("Файл %s загружен в Telegram, file_id сохранён", path)
+            return message
+
+
+static_assets = StaticAssets()
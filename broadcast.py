@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime
+from database import insert_broadcast_deliveries
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_HELP = (
+    "👥 Кому отправить рассылку?\n\n"
+    "Нажмите «👥 Все пользователи» или отправьте условия через пробел:\n"
+    "• тариф=basic,2025 — один или несколько тарифов\n"
+    "• статус=active | expired | never — активный доступ, истёкший, никогда не оплачивали\n"
+    "• активность=30 — заходили в бота за последние N дней\n"
+    "• регистрация=01.01.2025-31.03.2025 — дата регистрации (любую границу можно опустить)\n\n"
+    "Пример: тариф=basic статус=expired активность=60"
+)
+
+SEGMENT_KEYS = {
+    "тариф": "tariffs", "tariff": "tariffs",
+    "статус": "status", "status": "status",
+    "активность": "active_days", "active": "active_days",
+    "регистрация": "joined", "joined": "joined",
+}
+
+SEGMENT_STATUSES = {
+    "active": "active", "активные": "active",
+    "expired": "expired", "истёкшие": "expired", "истекшие": "expired",
+    "never": "never", "без_оплаты": "never",
+    "all": None, "все": None,
+}
+
+STATUS_NAMES = {"active": "с активным доступом", "expired": "с истёкшим доступом", "never": "без оплаты"}
+
+
+def _parse_date(value: str) -> str:
+    return datetime.strptime(value, "%d.%m.%Y").date().isoformat()
+
+
+# Сегмент хранится в FSM, поэтому в нём только JSON-совместимые значения.
+def parse_segment(text: str) -> dict:
+    segment = {}
+    text = (text or "").strip()
+    if text.lower() in ("все", "all", "👥 все пользователи"):
+        return segment
+
+    for part in text.split():
+        key, sep, value = part.partition("=")
+        field = SEGMENT_KEYS.get(key.lower())
+        if not sep or not field or not value:
+            raise ValueError(f"Непонятное условие: {part}")
+
+        if field == "tariffs":
+            segment["tariffs"] = [tariff.strip().lower() for tariff in value.split(",") if tariff.strip()]
+        elif field == "status":
+            if value.lower() not in SEGMENT_STATUSES:
+                raise ValueError(f"Неизвестный статус: {value}")
+            status = SEGMENT_STATUSES[value.lower()]
+            if status:
+                segment["status"] = status
+        elif field == "active_days":
+            if not value.isdigit() or int(value) <= 0:
+                raise ValueError(f"Активность задаётся числом дней: {value}")
+            segment["active_days"] = int(value)
+        elif field == "joined":
+            start, _, end = value.partition("-")
+            try:
+                if start:
+                    segment["joined_from"] = _parse_date(start)
+                if end:
+                    segment["joined_to"] = _parse_date(end)
+            except ValueError:
+                raise ValueError(f"Дата регистрации задаётся как ДД.ММ.ГГГГ-ДД.ММ.ГГГГ: {value}")
+    return segment
+
+
+def describe_segment(segment: dict) -> str:
+    if not segment:
+        return "все пользователи"
+
+    parts = []
+    if segment.get("tariffs"):
+        parts.append("тарифы " + ", ".join(tariff.upper() for tariff in segment["tariffs"]))
+    if segment.get("status"):
+        parts.append(STATUS_NAMES[segment["status"]])
+    if segment.get("active_days"):
+        parts.append(f"активные за {segment['active_days']} дн.")
+    if segment.get("joined_from") or segment.get("joined_to"):
+        parts.append(f"регистрация {segment.get('joined_from', '…')} — {segment.get('joined_to', '…')}")
+    return "; ".join(parts)
+
+
+# Результаты доставки копятся в памяти и пишутся в broadcast_deliveries пачками
+# в фоне, чтобы запись в БД не тормозила цикл рассылки.
+class DeliveryLog:
+    def __init__(self, job_id: str = None, batch_size: int = 500):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.batch_size = batch_size
+        self._rows = []
+        self._pending = set()
+
+    def record(self, user_id: int, status: str, error_class: str = None, latency_ms: int = None):
+        self._rows.append((user_id, status, error_class, latency_ms))
+        if len(self._rows) >= self.batch_size:
+            task = asyncio.create_task(self.flush())
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def flush(self):
+        rows, self._rows = self._rows, []
+        if not rows:
+            return
+        try:
+            await insert_broadcast_deliveries(self.job_id, rows)
+        except Exception as e:
+            logger.error("Не удалось записать журнал доставки рассылки %s: %s", self.job_id, e)
+
+    async def close(self):
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        await self.flush()
+
+
+# Общий ограничитель скорости исходящих рассылок (лимит Telegram — около 30 сообщений в секунду).
+class RateLimiter:
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+                now = self._next
+            self._next = now + self.interval
+
+
+# Прогресс рассылки публикуется отдельной задачей не чаще раза в interval секунд
+# из общих счётчиков — цикл отправки только увеличивает числа.
+class BroadcastProgress:
+    def __init__(self, message, total: int, interval: float = 5.0):
+        self.message = message
+        self.total = total
+        self.interval = interval
+        self.sent = 0
+        self.errors = 0
+        self.started = time.monotonic()
+        self._last_text = None
+        self._task = None
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.errors
+
+    def render(self) -> str:
+        elapsed = time.monotonic() - self.started
+        rate = self.processed / elapsed if elapsed > 0 else 0
+        remaining = self.total - self.processed
+        eta = f"{int(remaining / rate // 60)} мин {int(remaining / rate % 60)} сек" if rate else "—"
+        progress = int(self.processed / self.total * 100) if self.total else 100
+        return (
+            f"🔄 Рассылка в процессе...\n"
+            f"📊 Прогресс: {progress}% ({self.processed}/{self.total})\n"
+            f"✅ Успешно: {self.sent}\n"
+            f"❌ Ошибок: {self.errors}\n"
+            f"⚡️ Скорость: {rate:.1f} сообщ./сек\n"
+            f"⏳ Осталось: {eta}"
+        )
+
+    async def publish(self):
+        text = self.render()
+        if text == self._last_text:
+            return
+        try:
+            await self.message.edit_text(text)
+            self._last_text = text
+        except Exception as e:
+            logger.warning("Не удалось обновить прогресс рассылки: %s", e)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.publish()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,50 @@
+import csv
+import io
+
+BULK_HELP = (
+    "📥 Отправьте CSV-файл со строками «user_id,тариф».\n\n"
+    "• тариф — код из каталога (basic, pro, 2025, …): доступ выдаётся на срок тарифа\n"
+    "• revoke или - вместо тарифа: доступ отзывается, пользователь удаляется из групп\n"
+    "• разделитель — запятая или точка с запятой, строка заголовка допускается\n\n"
+    "Пример:\n"
+    "user_id,tariff\n"
+    "123456789,basic\n"
+    "987654321,revoke"
+)
+
+REVOKE_VALUES = {"revoke", "-", "отозвать"}
+MAX_BULK_FILE_SIZE = 1024 * 1024
+
+
+def parse_bulk_csv(text: str, catalog):
+    # Возвращает выдачи {user_id: тариф}, отзывы и список ошибок «строка N: причина».
+    # Если пользователь встречается несколько раз, действует последняя строка.
+    first_line = text.split("\n", 1)[0]
+    delimiter = ";" if ";" in first_line and "," not in first_line else ","
+
+    grants, revokes, errors = {}, {}, []
+    for line_number, row in enumerate(csv.reader(io.StringIO(text), delimiter=delimiter), start=1):
+        cells = [cell.strip() for cell in row]
+        if not any(cells):
+            continue
+        if len(cells) < 2:
+            errors.append(f"строка {line_number}: нужно два столбца")
+            continue
+
+        user_id, tariff = cells[0], cells[1].lower()
+        if not user_id.lstrip("-").isdigit():
+            if line_number == 1:
+                continue
+            errors.append(f"строка {line_number}: некорректный user_id «{user_id}»")
+            continue
+        user_id = int(user_id)
+
+        if tariff in REVOKE_VALUES:
+            grants.pop(user_id, None)
+            revokes[user_id] = True
+        elif tariff in catalog:
+            revokes.pop(user_id, None)
+            grants[user_id] = tariff
+        else:
+            errors.append(f"строка {line_number}: неизвестный тариф «{cells[1]}»")
+    return grants, list(revokes), errors
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+from aiogram import BaseMiddleware
+from callbacks import get_route_flag
+from database import DatabaseUnavailable
+from loop_watchdog import handler_label
+
+logger = logging.getLogger(__name__)
+
+
+# Фоновые продолжения обработчиков: одновременно выполняется не больше limit задач,
+# в очереди ждёт не больше max_pending. Сверх этого работа выполняется сразу в задаче апдейта,
+# то есть переполнение замедляет приём апдейтов, а не копит задачи без ограничений.
+class BackgroundTaskGroup:
+    def __init__(self, limit: int = 50, max_pending: int = 500, on_error=None):
+        self.max_pending = max_pending
+        self.on_error = on_error
+        self._semaphore = asyncio.Semaphore(limit)
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._tasks)
+
+    async def _run(self, coro, name: str):
+        async with self._semaphore:
+            try:
+                await coro
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Ошибка в фоновом обработчике %s: %s", name, e, exc_info=True)
+                if self.on_error is not None:
+                    try:
+                        self.on_error(name, e)
+                    except Exception as report_error:
+                        logger.warning("Не удалось сообщить об ошибке обработчика %s: %s", name, report_error)
+
+    async def submit(self, coro, name: str):
+        if len(self._tasks) >= self.max_pending:
+            logger.warning("Очередь фоновых обработчиков заполнена, %s выполняется сразу", name,
+                           extra={"sample_every": 50})
+            return await self._run(coro, name)
+        task = asyncio.create_task(self._run(coro, name), name=name)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def stop(self, timeout: float = 10.0):
+        if not self._tasks:
+            return
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning("Отменено незавершённых фоновых обработчиков: %s", len(pending))
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+# Для маршрутов с флагом ack callback подтверждается сразу (ack=True — без текста,
+# строка — со всплывающим текстом), а остальная работа обработчика уходит в фоновую группу.
+# Такие обработчики сами call.answer() не вызывают: второй ответ Telegram отклонит.
+# database_guard к этому моменту уже отработал, поэтому о недоступной БД пользователю
+# сообщается здесь, сообщением в чат.
+class CallbackAckMiddleware(BaseMiddleware):
+    def __init__(self, tasks: BackgroundTaskGroup, unavailable_text: str):
+        self.tasks = tasks
+        self.unavailable_text = unavailable_text
+
+    async def _continue(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        except DatabaseUnavailable as e:
+            logger.warning("Запрос отклонён: %s", e)
+            try:
+                await event.message.answer(self.unavailable_text)
+            except Exception as e:
+                logger.warning("Не удалось отправить ответ о недоступности БД: %s", e)
+
+    async def __call__(self, handler, event, data):
+        ack = get_route_flag(data, "ack")
+        if not ack:
+            return await handler(event, data)
+
+        try:
+            await event.answer(ack if isinstance(ack, str) else None)
+        except Exception as e:
+            logger.warning("Не удалось подтвердить callback: %s", e, extra={"sample_every": 50})
+        await self.tasks.submit(self._continue(handler, event, data), handler_label(event, data))
+        return None
@@ -0,0 +1,223 @@
+import logging
+from functools import lru_cache
+from typing import Optional
+from aiogram import F, types
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.dispatcher.flags import get_flag
+from aiogram.filters.callback_data import CallbackData
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = ":"
+
+
+class MenuCb(CallbackData, prefix="m"):
+    pass
+
+
+class TariffCb(CallbackData, prefix="t"):
+    tariff: str
+
+
+class YearCb(CallbackData, prefix="y"):
+    year: int
+
+
+class ReceiptCb(CallbackData, prefix="rc"):
+    tariff: str
+
+
+class MaterialsCb(CallbackData, prefix="gm"):
+    pass
+
+
+class UsedLinkCb(CallbackData, prefix="ul"):
+    pass
+
+
+class StartReviewCb(CallbackData, prefix="rs"):
+    pass
+
+
+class CancelReviewCb(CallbackData, prefix="rx"):
+    pass
+
+
+class SkipMediaCb(CallbackData, prefix="rm"):
+    pass
+
+
+# review_id = 0 — кнопка из старого сообщения, отзыв ещё не хранится в таблице reviews.
+class ApproveReviewCb(CallbackData, prefix="ra"):
+    review_id: int
+    user_id: int
+
+
+class RejectReviewCb(CallbackData, prefix="rj"):
+    review_id: int
+    user_id: int
+
+
+# Кнопки в уже отправленных сообщениях содержат старый формат callback_data.
+LEGACY_CALLBACKS = {
+    "menu": MenuCb(),
+    "self": TariffCb(tariff="self"),
+    "basic": TariffCb(tariff="basic"),
+    "pro": TariffCb(tariff="pro"),
+    "get_materials": MaterialsCb(),
+    "used_link": UsedLinkCb(),
+    "start_review": StartReviewCb(),
+    "cancel_review": CancelReviewCb(),
+    "skip_media": SkipMediaCb(),
+}
+
+LEGACY_PREFIXES = (
+    ("year_", lambda value: YearCb(year=int(value))),
+    ("send_screenshot_", lambda value: ReceiptCb(tariff=value)),
+    ("approve_review_", lambda value: ApproveReviewCb(review_id=0, user_id=int(value))),
+    ("reject_", lambda value: RejectReviewCb(review_id=0, user_id=int(value))),
+)
+
+
+def parse_legacy(data: str) -> Optional[CallbackData]:
+    callback_data = LEGACY_CALLBACKS.get(data)
+    if callback_data is not None:
+        return callback_data
+
+    for prefix, factory in LEGACY_PREFIXES:
+        if data.startswith(prefix):
+            try:
+                return factory(data[len(prefix):])
+            except ValueError:
+                return None
+    return None
+
+
+class Route:
+    __slots__ = ("callback_type", "handler", "name", "flags")
+
+    def __init__(self, callback_type, handler, flags):
+        self.callback_type = callback_type
+        self.handler = CallableObject(handler)
+        self.name = handler.__name__
+        self.flags = flags
+
+
+# Один обработчик callback_query на весь бот: маршрут выбирается по префиксу
+# callback_data через словарь, а не перебором фильтров.
+class CallbackRouter:
+    def __init__(self, cache_size: int = 4096):
+        self._routes = {}
+        # Набор callback_data конечен и повторяется, поэтому разбор кэшируется.
+        self.resolve = lru_cache(maxsize=cache_size)(self._resolve)
+
+    def route(self, callback_type, **flags):
+        def decorator(handler):
+            prefix = callback_type.__prefix__
+            if prefix in self._routes:
+                raise ValueError(f"Префикс callback_data '{prefix}' уже зарегистрирован")
+            self._routes[prefix] = Route(callback_type, handler, flags)
+            return handler
+        return decorator
+
+    def _resolve(self, data: Optional[str]):
+        if not data:
+            return None, None
+
+        route = self._routes.get(data.split(SEPARATOR, 1)[0])
+        if route is not None:
+            try:
+                return route, route.callback_type.unpack(data)
+            except (TypeError, ValueError):
+                return None, None
+
+        callback_data = parse_legacy(data)
+        if callback_data is None:
+            return None, None
+        return self._routes.get(callback_data.__prefix__), callback_data
+
+    async def _resolve_middleware(self, handler, event: types.CallbackQuery, data: dict):
+        data["callback_route"], data["callback_data"] = self.resolve(event.data)
+        return await handler(event, data)
+
+    async def _dispatch(self, call: types.CallbackQuery, callback_route: Route, **kwargs):
+        return await callback_route.handler.call(call, **kwargs)
+
+    def setup(self, router):
+        router.callback_query.outer_middleware(self._resolve_middleware)
+        router.callback_query.register(self._dispatch, has_route)
+
+
+def has_route(call: types.CallbackQuery, callback_route: Optional[Route] = None) -> bool:
+    return callback_route is not None
+
+
+def get_route_flag(data: dict, name: str, default=None):
+    # Флаги callback-обработчиков хранятся в маршруте, остальных — в флагах aiogram.
+    route = data.get("callback_route")
+    if route is not None and name in route.flags:
+        return route.flags[name]
+    return get_flag(data, name, default=default)
+
+
+callback_router = CallbackRouter()
+
+
+def _benchmark(iterations: int = 20_000):
+    import timeit
+
+    # Фильтры в том порядке, в котором aiogram проверял их до роутера.
+    linear_filters = [
+        F.data == "menu",
+        lambda c: c.data.startswith("year_"),
+        F.data.startswith("send_screenshot_"),
+        F.data.in_(["self", "basic", "pro", "offer", "send_screenshot_basic",
+                    "send_screenshot_pro", "get_materials", "used_link"]),
+        F.data == "used_link",
+        F.data == "start_review",
+        F.data == "cancel_review",
+        F.data == "skip_media",
+        F.data.startswith("approve_review_"),
+        F.data.startswith("reject_"),
+    ]
+    legacy_payloads = ["menu", "year_2027", "basic", "get_materials", "start_review",
+                       "skip_media", "approve_review_957724800", "reject_957724800"]
+
+    router = CallbackRouter()
+    for callback_type in (MenuCb, TariffCb, YearCb, ReceiptCb, MaterialsCb, UsedLinkCb, StartReviewCb,
+                          CancelReviewCb, SkipMediaCb, ApproveReviewCb, RejectReviewCb):
+        router.route(callback_type)(lambda call: None)
+
+    def make_call(data):
+        return types.CallbackQuery(
+            id="1", chat_instance="1", data=data,
+            from_user=types.User(id=1, is_bot=False, first_name="bench")
+        )
+
+    legacy_calls = [make_call(data) for data in legacy_payloads]
+    calls = [make_call(parse_legacy(data).pack()) for data in legacy_payloads]
+
+    def run_linear():
+        for call in legacy_calls:
+            for check in linear_filters:
+                matched = check(call) if callable(check) and not hasattr(check, "resolve") else check.resolve(call)
+                if matched:
+                    call.data.split("_")
+                    break
+
+    def run_router(values):
+        for call in values:
+            router.resolve(call.data)
+
+    results = {
+        "цепочка фильтров": timeit.timeit(run_linear, number=iterations),
+        "роутер": timeit.timeit(lambda: run_router(calls), number=iterations),
+        "роутер (старый формат)": timeit.timeit(lambda: run_router(legacy_calls), number=iterations),
+    }
+    updates = iterations * len(legacy_payloads)
+    for name, seconds in results.items():
+        print(f"{name}: {seconds / updates * 1e9:.0f} нс на апдейт")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -0,0 +1,37 @@
+import asyncio
+import csv
+import gzip
+import os
+import tempfile
+from contextlib import aclosing
+from database import EXPORT_QUERIES, iter_export_rows
+
+EXPORT_KINDS = tuple(EXPORT_QUERIES)
+
+
+class ExportResult:
+    def __init__(self, path: str, rows: int):
+        self.path = path
+        self.rows = rows
+        self.size = os.path.getsize(path)
+
+
+async def export_csv(kind: str, batch_size: int = 2000) -> ExportResult:
+    # CSV пишется в gzip-файл по мере чтения курсора, в памяти только одна пачка строк.
+    # Сжатие и запись на диск идут в отдельном потоке, не блокируя цикл событий. Файл удаляет вызывающий.
+    header, _ = EXPORT_QUERIES[kind]
+    fd, path = tempfile.mkstemp(prefix=f"export_{kind}_", suffix=".csv.gz")
+    os.close(fd)
+    rows = 0
+    try:
+        with gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=6) as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            async with aclosing(iter_export_rows(kind, batch_size)) as batches:
+                async for batch in batches:
+                    await asyncio.to_thread(writer.writerows, batch)
+                    rows += len(batch)
+    except BaseException:
+        os.remove(path)
+        raise
+    return ExportResult(path, rows)
@@ -0,0 +1,75 @@
+import logging
+from array import array
+from aiogram import BaseMiddleware
+from database import claim_update, delete_processed_updates
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateRing:
+    # Последние capacity update_id: массив int64 хранит порядок вытеснения, множество — быструю проверку.
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._ids = array("q", [0] * capacity)
+        self._seen = set()
+        self._position = 0
+        self._size = 0
+
+    def __contains__(self, update_id: int):
+        return update_id in self._seen
+
+    def add(self, update_id: int):
+        if self._size == self.capacity:
+            self._seen.discard(self._ids[self._position])
+        else:
+            self._size += 1
+        self._ids[self._position] = update_id
+        self._seen.add(update_id)
+        self._position = (self._position + 1) % self.capacity
+
+
+def needs_claim(update) -> bool:
+    # В БД отмечаются только апдейты с побочными эффектами, которые нельзя повторять: документы
+    # (чеки, CSV для /bulk) и нажатия кнопок (тарифы, ссылки-приглашения, модерация). Остальным
+    # хватает кольца, чтобы обычные сообщения не добавляли запись в БД на каждый апдейт.
+    if update.callback_query is not None:
+        return True
+    return update.message is not None and update.message.document is not None
+
+
+# Повторно доставленный апдейт (после падения при polling или на вторую реплику при webhook)
+# отбрасывается до любых обработчиков. Локальные повторы отсекает кольцо в памяти, между
+# репликами — вставка в processed_updates (для апдейтов из needs_claim). Апдейт помечается
+# обработанным до вызова обработчиков: если процесс упадёт посередине, апдейт потеряется,
+# но оплата не будет активирована дважды.
+class IdempotencyMiddleware(BaseMiddleware):
+    def __init__(self, capacity: int = 10000, ttl_hours: int = 48):
+        self.ring = UpdateRing(capacity)
+        self.ttl_hours = ttl_hours
+
+    async def __call__(self, handler, event, data):
+        update_id = event.update_id
+        if update_id in self.ring:
+            return self._skip(update_id, "кольцо")
+        self.ring.add(update_id)
+        if not needs_claim(event):
+            return await handler(event, data)
+
+        try:
+            claimed = await claim_update(update_id)
+        except Exception as e:
+            # Без БД защищает только кольцо в памяти; сам апдейт обработается как обычно.
+            logger.warning("Не удалось отметить апдейт %s в БД: %s", update_id, e, extra={"sample_every": 100})
+            claimed = True
+        if not claimed:
+            return self._skip(update_id, "БД")
+        return await handler(event, data)
+
+    def _skip(self, update_id: int, source: str):
+        logger.info("Повторный апдейт %s пропущен (%s)", update_id, source)
+        return None
+
+    async def cleanup(self):
+        deleted = await delete_processed_updates(self.ttl_hours)
+        if deleted:
+            logger.info("Удалено старых записей processed_updates: %s", deleted)
@@ -0,0 +1,127 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Атрибуты, которые есть у любой записи; всё остальное пришло через extra=.
+STANDARD_ATTRS = frozenset(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+listener = None
+
+
+# Сообщение и трейсбек собираются в вызывающем потоке, пока объекты из args ещё не изменились,
+# а args и exc_info очищаются, чтобы запись в очереди не держала кадры стека. В отличие от
+# стандартного QueueHandler.prepare, форматтер здесь не применяется: оформление (text или json)
+# и запись в поток остаются потоку QueueListener.
+class LazyQueueHandler(QueueHandler):
+    _exception_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+# Для частых однотипных сообщений (например, ошибок доставки рассылки) можно передать
+# extra={"sample_every": N}: выводится первое и затем каждое N-е сообщение с тем же шаблоном.
+class SamplingFilter(logging.Filter):
+    def __init__(self):
+        super().__init__()
+        self._seen = {}
+
+    def filter(self, record):
+        every = getattr(record, "sample_every", None)
+        if not every or every <= 1:
+            return True
+
+        key = (record.name, record.msg)
+        seen = self._seen.get(key, 0)
+        self._seen[key] = seen + 1
+        if seen % every:
+            return False
+        if seen:
+            record.sampled_skipped = every - 1
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        skipped = getattr(record, "sampled_skipped", None)
+        return f"{text} (пропущено похожих: {skipped})" if skipped else text
+
+
+def _direct_handler(formatter: logging.Formatter) -> logging.Handler:
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(formatter)
+    return handler
+
+
+def stop_logging():
+    # Дописывает оставшиеся в очереди записи.
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+def setup_logging(level: str = None, fmt: str = None):
+    global listener
+    if listener is not None:
+        return listener
+
+    level = (level or os.environ.get("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.environ.get("LOG_FORMAT", "text")).lower()
+    formatter = JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, _direct_handler(formatter), respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging)
+
+    # В дочерних процессах (воркеры парсинга чеков) потока QueueListener нет,
+    # поэтому там записи пишутся напрямую.
+    def _after_fork():
+        root.removeHandler(queue_handler)
+        root.addHandler(_direct_handler(formatter))
+
+    os.register_at_fork(after_in_child=_after_fork)
+    return listener
@@ -0,0 +1,191 @@
+import asyncio
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+LAG_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+STACK_DEPTH = 30
+ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+
+
+class Offender:
+    __slots__ = ("label", "count", "total_lag", "max_lag", "stack")
+
+    def __init__(self, label: str):
+        self.label = label
+        self.count = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.stack = []
+
+
+def handler_label(event, data: dict) -> str:
+    route = data.get("callback_route")
+    if route is not None:
+        name = route.name
+    else:
+        handler = data.get("handler")
+        name = getattr(getattr(handler, "callback", None), "__name__", "?")
+    return f"{type(event).__name__}:{name}"
+
+
+# Задача-пульс просыпается каждые interval секунд и пишет задержку цикла событий в гистограмму.
+# Отдельный поток следит за пульсом: если цикл не отвечает дольше threshold, он снимает стек
+# потока цикла и запоминает, какой обработчик (задача апдейта) сейчас выполняется.
+class LoopWatchdog:
+    def __init__(self, interval: float = 0.1, threshold: float = 0.2, max_offenders: int = 100):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_offenders = max_offenders
+        self.histogram = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.samples = 0
+        self.max_lag = 0.0
+        self.offenders = {}
+        self._labels = {}
+        self._stall = None
+        self._beat = time.monotonic()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._loop = None
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+
+    async def middleware(self, handler, event, data):
+        task = asyncio.current_task()
+        self._labels[task] = handler_label(event, data)
+        try:
+            return await handler(event, data)
+        finally:
+            self._labels.pop(task, None)
+
+    def _label_for(self, task) -> str:
+        if task is None:
+            return "вне задач (колбэк цикла)"
+        label = self._labels.get(task)
+        if label:
+            return label
+        coro = task.get_coro()
+        return f"задача {task.get_name()}:{getattr(coro, '__qualname__', coro)}"
+
+    def _record(self, lag: float):
+        lag_ms = lag * 1000
+        self.histogram[bisect.bisect_left(LAG_BUCKETS_MS, lag_ms)] += 1
+        self.samples += 1
+        self.max_lag = max(self.max_lag, lag)
+
+        with self._lock:
+            stall, self._stall = self._stall, None
+        if stall is None:
+            return
+        label, stack = stall
+        offender = self.offenders.get(label)
+        if offender is None:
+            if len(self.offenders) >= self.max_offenders:
+                weakest = min(self.offenders.values(), key=lambda item: item.max_lag)
+                if weakest.max_lag >= lag:
+                    return
+                del self.offenders[weakest.label]
+            offender = self.offenders[label] = Offender(label)
+        offender.count += 1
+        offender.total_lag += lag
+        if lag >= offender.max_lag:
+            offender.max_lag = lag
+            offender.stack = stack
+        logger.warning("Цикл событий заблокирован на %.0f мс: %s", lag_ms, label)
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+            self._record(max(0.0, now - started - self.interval))
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval / 2):
+            if time.monotonic() - self._beat < self.threshold:
+                continue
+            with self._lock:
+                if self._stall is not None:
+                    continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            try:
+                task = asyncio.current_task(self._loop)
+            except RuntimeError:
+                task = None
+            # Кадры самого asyncio одинаковы для любой блокировки и только занимают место.
+            frames = [item for item in traceback.extract_stack(frame) if ASYNCIO_DIR not in item.filename]
+            stack = traceback.format_list(frames[-STACK_DEPTH:])
+            with self._lock:
+                self._stall = (self._label_for(task), stack)
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self._thread = None
+
+    def reset(self):
+        self.histogram = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.samples = 0
+        self.max_lag = 0.0
+        self.offenders = {}
+
+    def percentile(self, q: float) -> str:
+        if not self.samples:
+            return "—"
+        rank = q * self.samples
+        seen = 0
+        for bound, count in zip(LAG_BUCKETS_MS, self.histogram):
+            seen += count
+            if seen >= rank:
+                return f"≤{bound} мс"
+        return f">{LAG_BUCKETS_MS[-1]} мс"
+
+    def worst(self, limit: int = 5):
+        return sorted(self.offenders.values(), key=lambda item: item.max_lag, reverse=True)[:limit]
+
+    def report(self, limit: int = 5, stack_lines: int = 6) -> str:
+        lines = [
+            f"⏱ Задержка цикла событий (замеров: {self.samples}, порог {self.threshold * 1000:.0f} мс)",
+            f"p50 {self.percentile(0.5)}, p95 {self.percentile(0.95)}, p99 {self.percentile(0.99)}, "
+            f"максимум {self.max_lag * 1000:.0f} мс",
+            "",
+        ]
+        lower = 0
+        for bound, count in zip(LAG_BUCKETS_MS + (None,), self.histogram):
+            if count:
+                lines.append(f"  {lower}–{bound} мс: {count}" if bound else f"  >{lower} мс: {count}")
+            lower = bound
+
+        offenders = self.worst(limit)
+        lines.append("")
+        lines.append("🐢 Худшие блокировки:" if offenders else "🐢 Блокировок выше порога не было")
+        for offender in offenders:
+            lines.append(
+                f"\n• {offender.label}: {offender.count} раз, максимум {offender.max_lag * 1000:.0f} мс, "
+                f"в среднем {offender.total_lag / offender.count * 1000:.0f} мс"
+            )
+            lines.extend(line.rstrip() for line in offender.stack[-stack_lines:])
+        return "\n".join(lines)
@@ -1,32 +1,59 @@
-import logging
 import time
+STARTED_AT = time.perf_counter()
+
+import logging
 import asyncio
 import os
-import pdfplumber
 import re
 import database
+import receipt_parser
+import tariffs
+from log_setup import setup_logging
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from aiogram import F
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram import Bot, Dispatcher, types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputFile
 from aiogram.filters import Command
-from aiogram.enums import ChatType
-from aiogram.types import FSInputFile
+from aiogram.enums import ChatType, ChatMemberStatus
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import FSInputFile, BufferedInputFile
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import BotCommandScopeAllPrivateChats
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from dotenv import load_dotenv
-from reviews import register_reviews_handlers
+from typing import Optional
+from reviews import register_reviews_handlers, review_publisher
+from assets import static_assets
+from throttling import ThrottlingMiddleware
+from loop_watchdog import LoopWatchdog
+from profiler import HandlerProfiler
+from admin_notify import AdminNotifier
+from receipt_store import ReceiptStore
+from export import EXPORT_KINDS, export_csv
+from idempotency import IdempotencyMiddleware
+from callback_ack import BackgroundTaskGroup, CallbackAckMiddleware
+from bulk import BULK_HELP, MAX_BULK_FILE_SIZE, parse_bulk_csv
+from broadcast import SEGMENT_HELP, BroadcastProgress, DeliveryLog, RateLimiter, parse_segment, describe_segment
+from callbacks import (
+    callback_router, MenuCb, TariffCb, YearCb, ReceiptCb, MaterialsCb, UsedLinkCb, StartReviewCb
+)
 from database import (
     save_user, get_user_access, set_user_access, revoke_user_access,
-    get_expired_users, get_all_active_users, get_all_users, get_stats,
-    check_duplicate_receipt, save_receipt, create_db_pool, init_db
+    claim_expired_users, bulk_set_user_access, bulk_revoke_user_access, get_all_active_users, get_stats,
+    check_duplicate_receipt, save_receipt, get_review_stats, DatabaseUnavailable, db_health_probe, count_segment_users, get_segment_users,
+    get_delivery_summary, create_scheduled_job, claim_due_jobs, finish_scheduled_job, interrupt_stale_jobs, cancel_scheduled_job,
+    get_scheduled_jobs, set_user_blocked, mark_users_blocked, create_db_pool, close_db_pool, init_db,
+    ensure_fiscal_partitions, archive_fiscal_partitions
 )
 
 load_dotenv()
+setup_logging()
 
 API_TOKEN = os.environ.get('API_TOKEN')
 if not API_TOKEN:
@@ -35,43 +62,139 @@ if not API_TOKEN:
 
 ADMIN_ID = 957724800
 
-GROUP_IDS = [-1002583988789, -1002529607781, -1002611068580, -1002607289832, -1002560662894, -1002645685285, -1002529375771, -1002262602915]
-RECEIPT_DIR = "/app/receipts"
+RECEIPT_DIR = os.environ.get('RECEIPT_DIR', "/app/receipts")
+OFFER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "oferta.pdf")
+
+BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', 25))
+BROADCAST_PROGRESS_INTERVAL = float(os.environ.get('BROADCAST_PROGRESS_INTERVAL', 5))
+ADMIN_DIGEST_INTERVAL = float(os.environ.get('ADMIN_DIGEST_INTERVAL', 60))
+# Время запланированных рассылок вводится и показывается по Астане.
+BROADCAST_TZ = timezone(timedelta(hours=float(os.environ.get('BROADCAST_UTC_OFFSET', 5))))
+SCHEDULED_POLL_INTERVAL = int(os.environ.get('SCHEDULED_POLL_INTERVAL', 30))
+SCHEDULED_STALE_HOURS = int(os.environ.get('SCHEDULED_STALE_HOURS', 12))
+GROUP_API_RATE = float(os.environ.get('GROUP_API_RATE', 20))
+BULK_CONCURRENCY = int(os.environ.get('BULK_CONCURRENCY', 10))
+MAX_EXPORT_FILE_SIZE = 50 * 1024 * 1024
+PROCESSED_UPDATES_RING = int(os.environ.get('PROCESSED_UPDATES_RING', 10000))
+PROCESSED_UPDATES_TTL_HOURS = int(os.environ.get('PROCESSED_UPDATES_TTL_HOURS', 48))
+CALLBACK_TASK_LIMIT = int(os.environ.get('CALLBACK_TASK_LIMIT', 50))
+LOOP_LAG_THRESHOLD_MS = float(os.environ.get('LOOP_LAG_THRESHOLD_MS', 200))
+PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', 2))
+MAX_RECEIPT_SIZE = int(os.environ.get('MAX_RECEIPT_SIZE', 2 * 1024 * 1024))
+MIN_RECEIPT_SIZE = int(os.environ.get('MIN_RECEIPT_SIZE', 512))
+RECEIPT_FILENAME_RE = re.compile(os.environ.get('RECEIPT_FILENAME_PATTERN', r"(?i)^[^/\\]{1,128}\.pdf$"))
+RECEIPT_SNIFF = os.environ.get('RECEIPT_SNIFF', '1') == '1'
+RECEIPT_COMPRESSION = os.environ.get('RECEIPT_COMPRESSION', 'gzip')
+RECEIPT_RETENTION_DAYS = int(os.environ.get('RECEIPT_RETENTION_DAYS', 365))
+RECEIPT_COMPACT_INTERVAL = float(os.environ.get('RECEIPT_COMPACT_INTERVAL', 6))
 
 os.makedirs(RECEIPT_DIR, exist_ok=True)
+receipt_store = ReceiptStore(RECEIPT_DIR, compression=RECEIPT_COMPRESSION, retention_days=RECEIPT_RETENTION_DAYS)
 
 bot = Bot(token=API_TOKEN)
 dp = Dispatcher()
+callback_router.setup(dp)
+DB_UNAVAILABLE_TEXT = "⚠️ Сервис временно недоступен. Пожалуйста, попробуйте через минуту."
+
+async def database_guard(handler, event, data):
+    # Пока БД недоступна, запросы к ней падают сразу, а пользователь получает
+    # заготовленный ответ вместо молчания.
+    try:
+        return await handler(event, data)
+    except DatabaseUnavailable as e:
+        logging.warning("Запрос отклонён: %s", e)
+        try:
+            if isinstance(event, types.CallbackQuery):
+                await event.answer(DB_UNAVAILABLE_TEXT, show_alert=True)
+            else:
+                await event.answer(DB_UNAVAILABLE_TEXT)
+        except Exception as e:
+            logging.warning("Не удалось отправить ответ о недоступности БД: %s", e)
+
+idempotency = IdempotencyMiddleware(PROCESSED_UPDATES_RING, PROCESSED_UPDATES_TTL_HOURS)
+dp.update.outer_middleware(idempotency)
+dp.message.outer_middleware(database_guard)
+dp.callback_query.outer_middleware(database_guard)
+profiler = HandlerProfiler()
+dp.message.middleware(profiler.middleware)
+dp.my_chat_member.middleware(profiler.middleware)
+loop_watchdog = LoopWatchdog(threshold=LOOP_LAG_THRESHOLD_MS / 1000)
+dp.message.middleware(loop_watchdog.middleware)
+dp.my_chat_member.middleware(loop_watchdog.middleware)
+throttling = ThrottlingMiddleware(exempt_ids={ADMIN_ID})
+dp.message.middleware(throttling)
+dp.callback_query.middleware(throttling)
+
+def report_callback_error(name: str, error: Exception):
+    admin_notifier.notify("callback_error", f"{name}: {error!r}")
+
+# Callback подтверждается сразу после ограничителя (чтобы отказ ограничителя ещё мог ответить текстом),
+# а профилировщик и сторож цикла событий оборачивают уже фоновую часть обработчика.
+callback_tasks = BackgroundTaskGroup(CALLBACK_TASK_LIMIT, on_error=report_callback_error)
+dp.callback_query.middleware(CallbackAckMiddleware(callback_tasks, DB_UNAVAILABLE_TEXT))
+dp.callback_query.middleware(profiler.middleware)
+dp.callback_query.middleware(loop_watchdog.middleware)
 scheduler = AsyncIOScheduler(timezone="UTC")
+broadcast_limiter = RateLimiter(BROADCAST_RATE)
+group_limiter = RateLimiter(GROUP_API_RATE)
+scheduled_runs = set()
+admin_notifier = AdminNotifier(bot, ADMIN_ID, flush_interval=ADMIN_DIGEST_INTERVAL)
 
 logger = logging.getLogger(__name__)
 
 class BroadcastStates(StatesGroup):
     waiting_content = State()
+    waiting_segment = State()
     waiting_confirm = State()
     waiting_time = State()
 
+class BulkStates(StatesGroup):
+    waiting_file = State()
+
 db_pool = None
+parse_executor = None
+background_tasks = []
+startup_timings = {}
 
-def setup_reviews(dp, bot, pool): 
-    from reviews import register_reviews_handlers
-    register_reviews_handlers(dp, bot, pool)
+@contextmanager
+def startup_stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = (time.perf_counter() - started) * 1000
 
-main_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text="Уровень САМОСТОЯТЕЛЬНЫЙ", callback_data="self")],
-    [InlineKeyboardButton(text="Уровень БАЗОВЫЙ", callback_data="basic")],
-    [InlineKeyboardButton(text="Уровень ПРО", callback_data="pro")],
-])
+def log_parser_warm_up(future: asyncio.Future):
+    if future.cancelled():
+        return
+    if future.exception() is not None:
+        logging.error("Не удалось запустить воркеры парсинга чеков: %s", future.exception())
+    else:
+        logging.info("Воркеры парсинга чеков запущены")
+
+def get_parse_executor():
+    global parse_executor
+    if parse_executor is None:
+        parse_executor = ProcessPoolExecutor(max_workers=PARSE_WORKERS, initializer=receipt_parser.warm_up)
+    return parse_executor
+
+# Клавиатуры собираются один раз на каждую версию каталога тарифов.
+@lru_cache(maxsize=2)
+def build_main_keyboard(catalog: tariffs.TariffCatalog):
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"Уровень {tariff.label}", callback_data=TariffCb(tariff=tariff.code).pack())]
+        for tariff in catalog.levels
+    ])
 
 async def get_materials_keyboard(user_id, pool, bot: Bot):
     if pool is None:
         logging.warning("Database pool not available in get_materials_keyboard.")
         return InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🏰 Получить материалы", callback_data="get_materials")]
+            [InlineKeyboardButton(text="🏰 Получить материалы", callback_data=MaterialsCb().pack())]
         ])
 
     try:
-        async with pool.acquire() as conn:
+        async with await database.get_db_connection() as conn:
             async with conn.cursor() as cur:  
                 await cur.execute("""
                     SELECT has_reviewed
@@ -81,46 +204,46 @@ async def get_materials_keyboard(user_id, pool, bot: Bot):
                 row = await cur.fetchone()
               
                 if not row:
-                    logging.warning(f"Пользователь {user_id} не найден в user_access")
+                    logging.warning("Пользователь %s не найден в user_access", user_id)
                     has_reviewed = False
                 else:
                     has_reviewed = row[0]
     except Exception as e:
-        logging.error(f"Ошибка при получении статуса отзыва: {e}")
+        logging.error("Ошибка при получении статуса отзыва: %s", e)
         has_reviewed = False
 
     buttons = [
-        [InlineKeyboardButton(text="🏰 Получить материалы", callback_data="get_materials")]
+        [InlineKeyboardButton(text="🏰 Получить материалы", callback_data=MaterialsCb().pack())]
     ]
 
     if not has_reviewed:
-        buttons.append([InlineKeyboardButton(text="📝 Оставить отзыв", callback_data="start_review")])
+        buttons.append([InlineKeyboardButton(text="📝 Оставить отзыв", callback_data=StartReviewCb().pack())])
 
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-def get_self_years_keyboard():
+@lru_cache(maxsize=2)
+def build_years_keyboard(catalog: tariffs.TariffCatalog):
     builder = InlineKeyboardBuilder()
-    for year in range(2025, 2032):
-        builder.button(text=f"Пенсия {year}", callback_data=f"year_{year}")
-    builder.button(text="◀️ Назад", callback_data="menu")
+    for tariff in catalog.years:
+        builder.button(text=f"Пенсия {tariff.code}", callback_data=YearCb(year=int(tariff.code)).pack())
+    builder.button(text="◀️ Назад", callback_data=MenuCb().pack())
     builder.adjust(2)
     return builder.as_markup()
 
-@dp.callback_query(F.data == "menu")
+@callback_router.route(MenuCb, ack=True)
 async def handle_back_to_menu(call: types.CallbackQuery):
     try:
         await call.message.edit_text(
             "👇 Выберите желаемый уровень:",
-            reply_markup=main_keyboard
+            reply_markup=build_main_keyboard(tariffs.catalog)
         )
-        await call.answer()
     except Exception as e:
-        logging.error(f"Ошибка в обработчике 'Назад': {e}")
+        logging.error("Ошибка в обработчике 'Назад': %s", e)
 
 def get_year_buttons(year):
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="✅ Оплатить", url="https://pay.kaspi.kz/pay/vx2s6z0c")],
-        [InlineKeyboardButton(text="📄 Отправить чек", callback_data=f"send_screenshot_{year}")]
+        [InlineKeyboardButton(text="📄 Отправить чек", callback_data=ReceiptCb(tariff=str(year)).pack())]
     ])
 
 @dp.message(Command("start"), F.chat.type == ChatType.PRIVATE)
@@ -157,9 +280,8 @@ async def cmd_start(message: types.Message):
                 "2️⃣ Доступ к закрытым материалам: текст, видео, фото — в зависимости от выбранного тарифа\n\n"
 
                 "💰 *Уровни:*\n"
-                "*САМОСТОЯТЕЛЬНЫЙ* — 15 000 тг\n"
-                "*БАЗОВЫЙ* — 100 000 тг\n"
-                "*ПРО* — 250 000 тг\n\n"
+                + "".join(f"*{tariff.label}* — {tariffs.format_price(tariff.price)} тг\n" for tariff in tariffs.catalog.levels)
+                + "\n"
 
                 "Ты можешь оплатить прямо здесь и отправить чек оплаты. После этого администратор активирует тебе доступ, и появится кнопка *ПОЛУЧИТЬ МАТЕРИАЛЫ*.\n\n"
 
@@ -168,7 +290,7 @@ async def cmd_start(message: types.Message):
             await message.answer(welcome_text, parse_mode="Markdown", reply_markup=main_kb.as_markup(resize_keyboard=True, one_time_keyboard=False))
             await message.answer(
                 "👇 Выберите желаемый уровень:",
-                reply_markup=main_keyboard  
+                reply_markup=build_main_keyboard(tariffs.catalog)  
             )
 
 
@@ -179,23 +301,17 @@ async def grant_access(message: types.Message):
 
     args = message.text.split()
     if len(args) < 3:
-        return await message.answer("Использование: /g [id] [basic/pro/2025-2031]")
+        return await message.answer(f"Использование: /g [id] [{'/'.join(tariffs.catalog.tariffs)}]")
 
     try:
         user_id = int(args[1])
         tariff = args[2].lower()
 
-        duration_map = {
-            "self": 15,
-            "basic": 60,
-            "pro": 180,
-            **{str(year): 15 for year in range(2025, 2032)} 
-        }
+        tariff_info = tariffs.catalog.get(tariff)
+        if tariff_info is None:
+            return await message.answer(f"❌ Неверный тариф. Допустимые: {tariffs.catalog.codes()}")
 
-        if tariff not in duration_map:
-            return await message.answer("❌ Неверный тариф. Допустимые: basic, pro, 2025-2031")
-
-        duration_days = duration_map[tariff]
+        duration_days = tariff_info.duration_days
 
         success = await set_user_access(user_id, duration_days, tariff)
         
@@ -211,9 +327,27 @@ async def grant_access(message: types.Message):
             await message.answer("❌ Ошибка при выдаче доступа")
 
     except Exception as e:
-        logging.error(f"Ошибка в /g: {e}")
+        logging.error("Ошибка в /g: %s", e)
         await message.answer("❌ Проверьте правильность аргументов")
 
+async def kick_from_group(group_id: int, user_id: int):
+    await group_limiter.wait()
+    await bot.ban_chat_member(group_id, user_id)
+    await bot.unban_chat_member(group_id, user_id)
+
+async def remove_from_groups(user_id: int) -> int:
+    # Запросы ко всем группам идут параллельно, темп задаёт group_limiter. Возвращает число ошибок.
+    group_ids = tariffs.catalog.chat_ids
+    results = await asyncio.gather(*(kick_from_group(group_id, user_id) for group_id in group_ids), return_exceptions=True)
+    failed = 0
+    for group_id, result in zip(group_ids, results):
+        if isinstance(result, Exception):
+            failed += 1
+            logging.warning("Не удалось удалить пользователя %s из группы %s: %s", user_id, group_id, result)
+        else:
+            logging.info("Пользователь %s удалён из группы %s", user_id, group_id)
+    return failed
+
 @dp.message(Command("revoke"), F.chat.type == ChatType.PRIVATE)
 async def revoke_access(message: types.Message):
     if message.from_user.id != ADMIN_ID:
@@ -231,20 +365,14 @@ async def revoke_access(message: types.Message):
             await revoke_user_access(user_id)
             await bot.send_message(user_id, "❌ Ваш доступ был отозван. Теперь вы не можете получать материалы.")
 
-            await bot.send_message(ADMIN_ID, f"Доступ пользователя {user_id} был отозван.")
+            admin_notifier.notify("revoke", f"Доступ пользователя {user_id} был отозван.", urgent=True)
 
-            for group_id in GROUP_IDS:
-                try:
-                    await bot.ban_chat_member(group_id, user_id)
-                    await bot.unban_chat_member(group_id, user_id)  
-                    logging.info(f"Пользователь {user_id} удалён из группы {group_id}")
-                except Exception as e:
-                    logging.error(f"Не удалось удалить пользователя из группы {group_id}: {e}")
+            await remove_from_groups(user_id)
         
         else:
             await message.answer("У пользователя нет доступа.")
     except Exception as e:
-        logging.error(f"Ошибка: {e}")
+        logging.error("Ошибка: %s", e)
         await message.answer("Произошла ошибка.")
 
 @dp.message(Command("status"), F.chat.type == ChatType.PRIVATE)
@@ -277,7 +405,7 @@ async def check_status(message: types.Message):
             await message.answer("❌ Доступа нет или он истек.")
 
     except Exception as e:
-        logging.error(f"Ошибка: {e}")
+        logging.error("Ошибка: %s", e)
         await message.answer("Ошибка при проверке статуса.")
 
 @dp.message(Command("help"), F.chat.type == ChatType.PRIVATE)
@@ -285,10 +413,20 @@ async def help_admin(message: types.Message):
     if message.from_user.id != ADMIN_ID:
         return await message.answer("❌ Нет доступа.")
     await message.answer("""
-/g [id] [basic/pro/2025-2031] - выдать доступ
+/g [id] [тариф] - выдать доступ
+/reload_tariffs - перечитать тарифы из таблицы tariffs
 /revoke [id] - отозвать доступ
+/bulk - выдать или отозвать доступ списком из CSV
 /status [id] - статус доступа
 /stats - статистика бота
+/reviews - отзывы и очередь публикации
+/deliveries [job_id] - итоги рассылки (по умолчанию последней)
+/profile [сек | updates N | stop] - профилирование обработчиков (по умолчанию 30 сек)
+/lag [reset] - задержки цикла событий и худшие блокирующие обработчики
+/scheduled - запланированные рассылки
+/cancel_job [id] - отменить запланированную рассылку
+/archive_receipts [месяцев] - отсоединить секции чеков старше N месяцев (по умолчанию 12)
+/export users|receipts - выгрузка пользователей или чеков в CSV (gzip)
 /help - команды
     """)
 
@@ -303,22 +441,12 @@ async def show_stats(message: types.Message):
         tariff_text = ""
         for tariff, count in stats['tariff_stats']:
             if tariff:
-                tariff_display = {
-                    'basic': 'БАЗОВЫЙ',
-                    'pro': 'ПРО', 
-                    'self': 'САМОСТОЯТЕЛЬНЫЙ'
-                }.get(tariff, f'Год {tariff}' if tariff.isdigit() else tariff.upper())
-                tariff_text += f"  • {tariff_display}: {count}\n"
+                tariff_text += f"  • {tariffs.catalog.label(tariff)}: {count}\n"
       
         popular_text = ""
         for tariff, count in stats['popular_tariffs'][:5]:  
             if tariff:
-                tariff_display = {
-                    'basic': 'БАЗОВЫЙ',
-                    'pro': 'ПРО',
-                    'self': 'САМОСТОЯТЕЛЬНЫЙ'
-                }.get(tariff, f'Год {tariff}' if tariff.isdigit() else tariff.upper())
-                popular_text += f"  • {tariff_display}: {count} чеков\n"
+                popular_text += f"  • {tariffs.catalog.label(tariff)}: {count} чеков\n"
         
         stats_text = f"""📊 **Статистика бота**
 
@@ -345,16 +473,260 @@ async def show_stats(message: types.Message):
         await message.answer(stats_text, parse_mode="Markdown")
         
     except Exception as e:
-        logging.error(f"Ошибка получения статистики: {e}")
+        logging.error("Ошибка получения статистики: %s", e)
         await message.answer("❌ Ошибка при получении статистики")
 
-@dp.callback_query(lambda c: c.data.startswith("year_"))
-async def handle_year_selection(call: types.CallbackQuery):
-    year = call.data.split("_")[1]
+@dp.message(Command("reviews"), F.chat.type == ChatType.PRIVATE)
+async def show_reviews(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        return await message.answer("❌ Нет доступа.")
+
+    try:
+        stats = await get_review_stats()
+    except Exception as e:
+        logging.error("Ошибка получения статистики отзывов: %s", e)
+        return await message.answer("❌ Ошибка при получении статистики отзывов")
+
+    status_names = {
+        'pending': 'На модерации',
+        'approved': 'В очереди на публикацию',
+        'publishing': 'Публикуются',
+        'published': 'Опубликованы',
+        'rejected': 'Отклонены',
+        'failed': 'Ошибка публикации'
+    }
+    status_text = "".join(
+        f"  • {status_names.get(status, status)}: {count}\n" for status, count in stats['by_status']
+    )
+    latest_text = "".join(
+        f"  • #{review_id} от {user_id} (@{username or '-'}) — {status_names.get(status, status)}, {created_at.strftime('%d.%m.%Y %H:%M')}\n"
+        for review_id, user_id, username, status, created_at in stats['latest']
+    )
+    await message.answer(
+        f"📝 Отзывы\n\n{status_text or '  • Нет отзывов'}\n\nПоследние:\n{latest_text or '  • Нет данных'}"
+    )
+
+@dp.message(Command("deliveries"), F.chat.type == ChatType.PRIVATE)
+async def show_deliveries(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        return await message.answer("❌ Нет доступа.")
+
+    args = message.text.split()
+    job_id = args[1] if len(args) > 1 else None
+
+    try:
+        summary = await get_delivery_summary(job_id)
+    except Exception as e:
+        logging.error("Ошибка получения журнала рассылки: %s", e)
+        return await message.answer("❌ Ошибка при получении журнала рассылки")
+
+    if not summary:
+        return await message.answer("❌ Рассылка не найдена")
+
+    failures_text = "".join(
+        f"  • {error_class or status}: {count}\n" for status, error_class, count in summary['failures']
+    )
+    duration = (summary['finished_at'] - summary['started_at']).total_seconds()
+    await message.answer(
+        f"🧾 Рассылка {summary['job_id']}\n\n"
+        f"👥 Получателей: {summary['total']}\n"
+        f"✅ Доставлено: {summary['sent']}\n"
+        f"⏱ Длительность: {int(duration)} сек.\n"
+        f"📶 Задержка: в среднем {int(summary['avg_latency'] or 0)} мс, p95 {int(summary['p95_latency'] or 0)} мс\n\n"
+        f"❌ Ошибки:\n{failures_text or '  • Нет'}"
+    )
+
+@dp.message(Command("scheduled"), F.chat.type == ChatType.PRIVATE)
+async def show_scheduled_jobs(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        return await message.answer("❌ Нет доступа.")
+
+    try:
+        jobs = await get_scheduled_jobs()
+    except Exception as e:
+        logging.error("Ошибка получения запланированных заданий: %s", e)
+        return await message.answer("❌ Ошибка при получении запланированных рассылок")
+
+    if not jobs:
+        return await message.answer("🗓 Запланированных рассылок нет")
+
+    status_names = {
+        'pending': '⏳ ожидает',
+        'running': '🔄 выполняется',
+        'done': '✅ выполнена',
+        'failed': '❌ ошибка',
+        'interrupted': '⚠️ прервана',
+        'cancelled': '🚫 отменена'
+    }
+    lines = []
+    for job_id, kind, payload, run_at, status, result in jobs:
+        text = (payload.get('content', {}).get('text') or '').replace('\n', ' ')
+        line = (
+            f"#{job_id} — {run_at.astimezone(BROADCAST_TZ).strftime('%d.%m.%Y %H:%M')}, "
+            f"{status_names.get(status, status)}\n"
+            f"  👥 {describe_segment(payload.get('segment', {}))}\n"
+            f"  📝 {text[:60] or '(медиа без текста)'}"
+        )
+        if status == 'done' and result:
+            line += f"\n  📨 {result.get('sent')} из {result.get('total')}"
+        lines.append(line)
+    await message.answer(("🗓 Рассылки:\n\n" + "\n\n".join(lines))[:4096])
+
+@dp.message(Command("cancel_job"), F.chat.type == ChatType.PRIVATE)
+async def cancel_job(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        return await message.answer("❌ Нет доступа.")
+
+    args = message.text.split()
+    if len(args) < 2 or not args[1].lstrip('#').isdigit():
+        return await message.answer("Использование: /cancel_job [id]")
+    job_id = int(args[1].lstrip('#'))
+
+    try:
+        cancelled = await cancel_scheduled_job(job_id)
+    except Exception as e:
+        logging.error("Ошибка отмены задания #%s: %s", job_id, e)
+        return await message.answer("❌ Ошибка при отмене рассылки")
+
+    if cancelled:
+        await message.answer(f"🚫 Рассылка #{job_id} отменена")
+    else:
+        await message.answer(f"❌ Рассылка #{job_id} не найдена или уже запущена")
+
+@dp.message(Command("archive_receipts"), F.chat.type == ChatType.PRIVATE)
+async def archive_receipts(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        return await message.answer("❌ Нет доступа.")
+
+    args = message.text.split()
+    if len(args) > 1 and not args[1].isdigit():
+        return await message.answer("Использование: /archive_receipts [месяцев]")
+    keep_months = int(args[1]) if len(args) > 1 else 12
+
+    try:
+        archived = await archive_fiscal_partitions(keep_months)
+    except Exception as e:
+        logging.error("Ошибка архивации чеков: %s", e)
+        return await message.answer("❌ Ошибка при архивации чеков")
+
+    if not archived:
+        return await message.answer(f"📦 Секций чеков старше {keep_months} мес. нет")
+    await message.answer(
+        f"📦 Отсоединено секций: {len(archived)}\n" + "\n".join(f"  • {name}" for name in archived)
+    )
+
+@dp.message(Command("export"), F.chat.type == ChatType.PRIVATE)
+async def export_data(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        return await message.answer("❌ Нет доступа.")
+
+    args = message.text.split()
+    if len(args) != 2 or args[1] not in EXPORT_KINDS:
+        return await message.answer(f"Использование: /export {'|'.join(EXPORT_KINDS)}")
+    kind = args[1]
+
+    status_msg = await message.answer("⏳ Выгрузка...")
+    started = time.monotonic()
+    try:
+        result = await export_csv(kind)
+    except Exception as e:
+        logging.error("Ошибка выгрузки %s: %s", kind, e)
+        return await status_msg.edit_text("❌ Ошибка при выгрузке")
+
+    try:
+        if result.size > MAX_EXPORT_FILE_SIZE:
+            return await status_msg.edit_text(
+                f"❌ Файл выгрузки слишком большой для отправки: {result.size // (1024 * 1024)} МБ"
+            )
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        await message.answer_document(
+            FSInputFile(result.path, filename=f"{kind}_{stamp}.csv.gz"),
+            caption=f"📤 Строк: {result.rows}, {int(time.monotonic() - started)} сек."
+        )
+        await status_msg.delete()
+    finally:
+        os.remove(result.path)
+
+@dp.message(Command("reload_tariffs"), F.chat.type == ChatType.PRIVATE)
+async def reload_tariffs(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        return await message.answer("❌ Нет доступа.")
+
+    try:
+        catalog = await tariffs.load_catalog()
+    except Exception as e:
+        logging.error("Ошибка загрузки тарифов: %s", e)
+        return await message.answer(f"❌ Не удалось загрузить тарифы ({e}), используется прежний каталог")
+
+    lines = "".join(
+        f"  • {tariff.code} — {tariff.label}: {tariff.price} ₸, {tariff.duration_days} дн."
+        f"{', группа ' + str(tariff.chat_id) if tariff.chat_id else ''}\n"
+        for tariff in catalog.tariffs.values()
+    )
+    await message.answer(f"✅ Тарифов загружено: {len(catalog)}\n{lines}")
+
+@dp.message(Command("lag"), F.chat.type == ChatType.PRIVATE)
+async def show_loop_lag(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        return await message.answer("❌ Нет доступа.")
+
+    if message.text.split()[1:2] == ["reset"]:
+        loop_watchdog.reset()
+        return await message.answer("✅ Статистика задержек сброшена")
+    await message.answer(loop_watchdog.report()[:4096])
+
+async def send_profile_report(report):
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    await bot.send_message(ADMIN_ID, report.summary()[:4096])
+    await bot.send_document(
+        ADMIN_ID, BufferedInputFile(report.pstats_data, f"profile_{stamp}.pstats"),
+        caption="cProfile: python -m pstats profile.pstats"
+    )
+    if report.collapsed:
+        await bot.send_document(
+            ADMIN_ID, BufferedInputFile(report.collapsed, f"stacks_{stamp}.txt"),
+            caption="Стеки в формате collapsed (flamegraph.pl, speedscope)"
+        )
+
+@dp.message(Command("profile"), F.chat.type == ChatType.PRIVATE)
+async def start_profiling(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        return await message.answer("❌ Нет доступа.")
+
+    args = message.text.split()[1:]
+    if args == ["stop"]:
+        if not profiler.active:
+            return await message.answer("Профилирование не запущено")
+        profiler.stop()
+        return await message.answer("⏹ Профилирование остановлено, отчёт придёт следующим сообщением")
+
+    seconds, updates = None, None
+    if len(args) == 2 and args[0] == "updates" and args[1].isdigit() and int(args[1]) > 0:
+        updates = int(args[1])
+    elif not args or (len(args) == 1 and args[0].isdigit() and 0 < int(args[0]) <= 600):
+        seconds = int(args[0]) if args else 30
+    else:
+        return await message.answer("Использование: /profile [секунд до 600] | /profile updates N | /profile stop")
+
+    try:
+        profiler.start(send_profile_report, seconds=seconds, updates=updates)
+    except RuntimeError as e:
+        return await message.answer(f"❌ {e}")
+    await message.answer(
+        f"🔬 Профилирование запущено на {seconds} сек." if seconds
+        else f"🔬 Профилирование запущено на {updates} апдейтов"
+    )
+
+@callback_router.route(YearCb, ack=True)
+async def handle_year_selection(call: types.CallbackQuery, callback_data: YearCb):
+    year = str(callback_data.year)
+    tariff = tariffs.catalog.get(year)
+    if tariff is None or tariff.kind != tariffs.YEAR:
+        return await call.message.answer("❌ Этот год сейчас недоступен")
 
     await set_user_access(call.from_user.id, duration_days=None, tariff=year)
     
-    text = """
+    text = f"""
 🔹 Уровень САМОСТОЯТЕЛЬНЫЙ — чтобы увидеть свою будущую пенсию без сложных расчётов
 
 📌 Подходит, если:
@@ -368,25 +740,25 @@ async def handle_year_selection(call: types.CallbackQuery):
 ✔️ Инструкции: что проверить, где взять данные, как не упустить важное
 ✔️ Конечный продукт с расчетом вашей пенсии
 
-⏰ Доступ: 15 дней
+⏰ Доступ: {tariffs.format_days(tariff.duration_days)}
 💬 Вопросы — в общем чате можно задавать вопросы по заполнению таблицы
-💳 Стоимость: 15 000 ₸
+💳 Стоимость: {tariffs.format_price(tariff.price)} ₸
 
 👇 Нажмите «✅ Оплатить», чтобы перейти к реквизитам.
 """
     
     await call.message.answer(text, reply_markup=get_year_buttons(year))
 
-@dp.callback_query(F.data.startswith("send_screenshot_"))
-async def handle_screenshot(call: types.CallbackQuery):
+@callback_router.route(ReceiptCb, ack=True)
+async def handle_screenshot(call: types.CallbackQuery, callback_data: ReceiptCb):
     user_id = call.from_user.id
     expire_time, current_tariff = await get_user_access(user_id)
  
     if expire_time and expire_time > datetime.now():
-        await call.answer("❗ У вас уже есть активный доступ!", show_alert=True)
+        await call.message.answer("❗ У вас уже есть активный доступ!")
         return
     
-    selected_tariff_or_year = call.data.split("_")[2]
+    selected_tariff_or_year = callback_data.tariff
   
     await call.message.answer(
         "📄 Пожалуйста, отправьте PDF-файл фискального чека из Kaspi!\n\n"
@@ -396,40 +768,36 @@ async def handle_screenshot(call: types.CallbackQuery):
         "3. Отправьте чек в этот чат\n\n"
     )
 
-@dp.callback_query(
-    F.data.in_([
-        "self", "basic", "pro", "offer",
-        "send_screenshot_basic", "send_screenshot_pro",  
-        "get_materials", "used_link"
-    ])
-)
-async def handle_callback(call: types.CallbackQuery):
+@callback_router.route(TariffCb, ack=True)
+async def handle_callback(call: types.CallbackQuery, callback_data: TariffCb):
     if call.message.chat.type != ChatType.PRIVATE:
         return 
     
-    data = call.data
+    data = callback_data.tariff
     user_id = call.from_user.id
 
-    if data in ["self", "basic", "pro"]:
-        
+    tariff = tariffs.catalog.get(data)
+    if tariff is None:
+        return await call.message.answer("❌ Этот тариф сейчас недоступен")
+    if tariff.kind == tariffs.LEVEL:
         success = await set_user_access(user_id, duration_days=None, tariff=data)
 
         if not success:
-            await call.answer("❌ Ошибка сохранения тарифа")
+            await call.message.answer("❌ Ошибка сохранения тарифа")
             return
     
     if data == "self":
-        await call.message.answer("📅 Выберите год вашего выхода на пенсию:", reply_markup=get_self_years_keyboard())
+        await call.message.answer("📅 Выберите год вашего выхода на пенсию:", reply_markup=build_years_keyboard(tariffs.catalog))
         return
 
     if data == "basic":
         await set_user_access(user_id, None, "basic")  
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="✅ Оплатить", url="https://pay.kaspi.kz/pay/vx2s6z0c")],
-            [InlineKeyboardButton(text="📄 Отправить чек", callback_data="send_screenshot_basic")]
+            [InlineKeyboardButton(text="📄 Отправить чек", callback_data=ReceiptCb(tariff="basic").pack())]
         ])
         await call.message.answer(
-        """
+        f"""
 🔸 Уровень БАЗОВЫЙ — мини-курс для тех, кто хочет понимать расчёт пенсии и помогать другим
 
 📚 Вы получите:
@@ -443,9 +811,9 @@ async def handle_callback(call: types.CallbackQuery):
 – планирует помогать другим (как консультант или помощник)
 – не хочет тратить время на самостоятельное изучение всех нюансов
 
-⏰ Доступ: 60 дней
+⏰ Доступ: {tariffs.format_days(tariff.duration_days)}
 💬 Поддержка: вопрос-ответ в общем чате
-💳 Стоимость: 100 000 ₸
+💳 Стоимость: {tariffs.format_price(tariff.price)} ₸
 
 👇 Нажмите «✅ Оплатить», чтобы перейти к реквизитам.
         """,
@@ -455,168 +823,309 @@ async def handle_callback(call: types.CallbackQuery):
         await set_user_access(user_id, None, "pro")  
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="✅ Оплатить", url="https://pay.kaspi.kz/pay/vx2s6z0c")],
-            [InlineKeyboardButton(text="📄 Отправить чек", callback_data="send_screenshot_pro")]
+            [InlineKeyboardButton(text="📄 Отправить чек", callback_data=ReceiptCb(tariff="pro").pack())]
         ])
         await call.message.answer("❌ Временно недоступно", reply_markup=keyboard)
-    
-    elif data == "get_materials":
-        await call.answer()
-        await call.message.edit_reply_markup(
+
+@callback_router.route(MaterialsCb, throttle="materials", ack=True)
+async def handle_get_materials(call: types.CallbackQuery):
+    if call.message.chat.type != ChatType.PRIVATE:
+        return 
+
+    user_id = call.from_user.id
+    await call.message.edit_reply_markup(
         reply_markup=InlineKeyboardMarkup(
             inline_keyboard=[
                 [
                     InlineKeyboardButton(
                         text="✅ Материалы получены", 
-                        callback_data="used_link"
+                        callback_data=UsedLinkCb().pack()
                     ),
                     InlineKeyboardButton(
                         text="📝 Оставить отзыв", 
-                        callback_data="start_review"
+                        callback_data=StartReviewCb().pack()
                     )
                 ]
             ]
         )
     )
-        expire_time, tariff = await get_user_access(user_id)
-        if not expire_time or expire_time < datetime.now():
-            return await call.message.answer("❌ У вас нет активного доступа.")
-
-        tariff_chat_map = {
-            "basic": -1002583988789,
-            "2025": -1002529607781,
-            "2026": -1002611068580,
-            "2027": -1002607289832,
-            "2028": -1002560662894,
-            "2029": -1002645685285,
-            "2030": -1002529375771,
-            "2031": -1002262602915
-        }
-
-        chat_id = tariff_chat_map.get(tariff)
-        if not chat_id:
-            return await call.message.answer("❌ Не удалось определить канал по вашему тарифу.")
+    expire_time, tariff = await get_user_access(user_id)
+    if not expire_time or expire_time < datetime.now():
+        return await call.message.answer("❌ У вас нет активного доступа.")
 
-        try:
-            invite = await bot.create_chat_invite_link(
-                chat_id=chat_id,
-                member_limit=1,
-                expire_date=int(time.time()) + 20,
-                creates_join_request=False
-            )
+    tariff_info = tariffs.catalog.get(tariff)
+    chat_id = tariff_info.chat_id if tariff_info else None
+    if not chat_id:
+        return await call.message.answer("❌ Не удалось определить канал по вашему тарифу.")
+
+    try:
+        invite = await bot.create_chat_invite_link(
+            chat_id=chat_id,
+            member_limit=1,
+            expire_date=int(time.time()) + 20,
+            creates_join_request=False
+        )
   
-            msg = await call.message.answer(
-                f"🔐 Ваша персональная ссылка (исчезнет спустя 20 секунд):\n{invite.invite_link}"
-            )
-            
-            await asyncio.sleep(20)
-            try:
-                await msg.delete()
-            except Exception as e:
-                logging.error(f"Не удалось удалить сообщение: {e}")
-            
+        msg = await call.message.answer(
+            f"🔐 Ваша персональная ссылка (исчезнет спустя 20 секунд):\n{invite.invite_link}"
+        )
+        
+        await asyncio.sleep(20)
+        try:
+            await msg.delete()
         except Exception as e:
-            logging.error(f"Ошибка создания ссылки для чата {chat_id}: {e}")
-            await call.message.answer("⚠️ Ошибка при создании ссылки.")
+            logging.error("Не удалось удалить сообщение: %s", e)
+        
+    except Exception as e:
+        logging.error("Ошибка создания ссылки для чата %s: %s", chat_id, e)
+        await call.message.answer("⚠️ Ошибка при создании ссылки.")
 
-@dp.callback_query(F.data == "used_link")
+@callback_router.route(UsedLinkCb)
 async def handle_used_link(call: types.CallbackQuery):
     await call.answer("Вы уже использовали эту ссылку", show_alert=True)
 
 async def parse_kaspi_receipt(pdf_path: str):
+    loop = asyncio.get_running_loop()
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            text = "\n".join(page.extract_text() for page in pdf.pages)
-            
-            data = {
-                "amount": float(re.search(r"(\d+)\s*₸", text).group(1)) if re.search(r"(\d+)\s*₸", text) else None,
-                "iin": re.search(r"ИИН/БИН продавца\s*(\d+)", text).group(1) if re.search(r"ИИН/БИН продавца\s*(\d+)", text) else None,
-                "check_number": re.search(r"№ чека\s*(\S+)", text).group(1) if re.search(r"№ чека\s*(\S+)", text) else None,
-                "fp": re.search(r"ФП\s*(\d+)", text).group(1) if re.search(r"ФП\s*(\d+)", text) else None,
-                "date_time": re.search(r"Дата и время\s*(?:по Астане)?\s*(\d{2}\.\d{2}\.\d{4} \d{2}:\d{2})"
-, text).group(1) if re.search(r"Дата и время\s*(?:по Астане)?\s*(\d{2}\.\d{2}\.\d{4} \d{2}:\d{2})"
-, text) else None,
-                "buyer_name": re.search(r"ФИО покупателя\s*(.+)", text).group(1).strip() if re.search(r"ФИО покупателя\s*(.+)", text) else None
-            }
-            return data
+        return await loop.run_in_executor(get_parse_executor(), receipt_parser.parse_kaspi_receipt_file, pdf_path)
     except Exception as e:
-        logging.error(f"Ошибка парсинга PDF: {e}")
+        logging.error("Ошибка парсинга PDF: %s", e)
         return None
 
-@dp.message(F.document, F.chat.type == ChatType.PRIVATE)
+def prevalidate_receipt(document: types.Document) -> Optional[str]:
+    # Дешёвые проверки по метаданным документа — до запросов в БД и скачивания.
+    if document.mime_type != 'application/pdf':
+        return "❌ Пожалуйста, отправьте PDF-файл чека из Kaspi"
+    if document.file_size is not None and not MIN_RECEIPT_SIZE <= document.file_size <= MAX_RECEIPT_SIZE:
+        return "❌ Размер файла не похож на чек Kaspi"
+    if not document.file_name or not RECEIPT_FILENAME_RE.match(document.file_name):
+        return "❌ Пожалуйста, отправьте PDF-файл чека из Kaspi"
+    return None
+
+async def download_receipt(bot: Bot, document: types.Document, destination: str) -> Optional[str]:
+    file = await bot.get_file(document.file_id)
+    if not RECEIPT_SNIFF or bot.session.api.is_local:
+        await bot.download(file=file, destination=destination)
+        return None
+
+    # Потоковое скачивание: сигнатура %PDF проверяется по первому чанку,
+    # размер — по мере получения, без ожидания всего файла.
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    header = b""
+    received = 0
+    error = None
+    with open(destination, "wb") as f:
+        async for chunk in bot.session.stream_content(url=url, timeout=30, chunk_size=65536, raise_for_status=True):
+            received += len(chunk)
+            if received > MAX_RECEIPT_SIZE:
+                error = "❌ Размер файла не похож на чек Kaspi"
+                break
+            if len(header) < 5:
+                header += chunk[:5 - len(header)]
+                if len(header) == 5 and header != b"%PDF-":
+                    error = "❌ Файл не является PDF-документом"
+                    break
+            f.write(chunk)
+
+    if error is None and received < 5:
+        error = "❌ Файл не является PDF-документом"
+    if error:
+        os.remove(destination)
+    return error
+
+@dp.message(Command("bulk"), F.chat.type == ChatType.PRIVATE)
+async def start_bulk(message: types.Message, state: FSMContext):
+    if message.from_user.id != ADMIN_ID:
+        return await message.answer("❌ Нет доступа.")
+
+    cancel_kb = ReplyKeyboardBuilder()
+    cancel_kb.button(text="❌ Отменить")
+    await message.answer(BULK_HELP, reply_markup=cancel_kb.as_markup(resize_keyboard=True))
+    await state.set_state(BulkStates.waiting_file)
+
+# Обработчики состояния /bulk должны стоять раньше handle_document, иначе CSV примут за чек.
+@dp.message(BulkStates.waiting_file, F.document)
+async def process_bulk_file(message: types.Message, state: FSMContext, bot: Bot):
+    # Один снимок каталога на всю операцию: /reload_tariffs посреди обработки не должен
+    # убрать тариф, уже принятый при разборе файла.
+    catalog = tariffs.catalog
+    await state.clear()
+    if message.document.file_size and message.document.file_size > MAX_BULK_FILE_SIZE:
+        return await message.answer("❌ Файл слишком большой", reply_markup=types.ReplyKeyboardRemove())
+
+    try:
+        buffer = await bot.download(message.document)
+        text = buffer.getvalue().decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return await message.answer("❌ Файл должен быть в кодировке UTF-8", reply_markup=types.ReplyKeyboardRemove())
+    except Exception as e:
+        logging.error("Ошибка загрузки CSV: %s", e)
+        return await message.answer("❌ Не удалось скачать файл", reply_markup=types.ReplyKeyboardRemove())
+
+    grants, revokes, errors = parse_bulk_csv(text, catalog)
+    if not grants and not revokes:
+        details = "\n".join(errors[:20])
+        return await message.answer(f"❌ В файле нет строк для обработки\n{details}", reply_markup=types.ReplyKeyboardRemove())
+
+    status_msg = await message.answer(
+        f"⏳ Обработка: выдача {len(grants)}, отзыв {len(revokes)}, ошибок в файле {len(errors)}...",
+        reply_markup=types.ReplyKeyboardRemove()
+    )
+
+    try:
+        granted = await bulk_set_user_access([
+            (user_id, catalog.get(tariff).duration_days, tariff) for user_id, tariff in grants.items()
+        ]) if grants else []
+        revoked = await bulk_revoke_user_access(revokes) if revokes else []
+    except Exception as e:
+        logging.error("Ошибка массового изменения доступа: %s", e)
+        return await status_msg.edit_text("❌ Ошибка при сохранении доступа, изменения не применены")
+
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+    counters = {"notified": 0, "notify_failed": 0, "group_failed": 0}
+    blocked = []
+
+    async def notify(user_id: int, text: str, reply_markup=None):
+        try:
+            await broadcast_limiter.wait()
+            await bot.send_message(user_id, text, reply_markup=reply_markup)
+            counters["notified"] += 1
+        except TelegramForbiddenError:
+            blocked.append(user_id)
+        except Exception as e:
+            counters["notify_failed"] += 1
+            logging.warning("Не удалось уведомить пользователя %s: %s", user_id, e, extra={"sample_every": 50})
+
+    async def process_grant(user_id: int):
+        async with semaphore:
+            tariff = catalog.get(grants[user_id])
+            expire_date = (datetime.now() + timedelta(days=tariff.duration_days)).strftime("%d.%m.%Y %H:%M")
+            await notify(
+                user_id,
+                f"✅ Доступ к материалам уровня {tariff.label} активирован до {expire_date}!",
+                await get_materials_keyboard(user_id, db_pool, bot)
+            )
+
+    async def process_revoke(user_id: int):
+        async with semaphore:
+            await notify(user_id, "❌ Ваш доступ был отозван. Теперь вы не можете получать материалы.")
+            counters["group_failed"] += await remove_from_groups(user_id)
+
+    started = time.monotonic()
+    await asyncio.gather(*(process_grant(user_id) for user_id in granted),
+                         *(process_revoke(user_id) for user_id in revoked))
+
+    try:
+        await mark_users_blocked(blocked)
+    except Exception as e:
+        logging.error("Не удалось отметить заблокировавших бота пользователей: %s", e)
+
+    errors_text = "".join(f"\n  • {error}" for error in errors[:20])
+    if len(errors) > 20:
+        errors_text += f"\n  • ... и ещё {len(errors) - 20}"
+    await status_msg.edit_text(
+        f"📊 Массовое изменение доступа завершено за {int(time.monotonic() - started)} сек.\n\n"
+        f"✅ Выдан доступ: {len(granted)}\n"
+        f"⛔️ Отозван доступ: {len(revoked)} (без активного доступа: {len(revokes) - len(revoked)})\n"
+        f"📨 Уведомлено: {counters['notified']}\n"
+        f"🚫 Заблокировали бота: {len(blocked)}\n"
+        f"❌ Ошибок уведомления: {counters['notify_failed']}\n"
+        f"👥 Ошибок удаления из групп: {counters['group_failed']}\n"
+        f"📄 Ошибок в файле: {len(errors)}{errors_text}"
+    )
+
+@dp.message(BulkStates.waiting_file)
+async def process_bulk_other(message: types.Message, state: FSMContext):
+    if message.text == "❌ Отменить":
+        await state.clear()
+        return await show_main_menu(message, "❌ Массовая операция отменена")
+    await message.answer("📎 Отправьте CSV-файл или нажмите «❌ Отменить»")
+
+@dp.message(F.document, F.chat.type == ChatType.PRIVATE, flags={"throttle": "receipt"})
 async def handle_document(message: types.Message, state: FSMContext, bot: Bot):
     global db_pool
-    logging.info(f"Получен документ: {message.document.file_name}")
+    logging.info("Получен документ: %s", message.document.file_name)
     user = message.from_user
 
+    error = prevalidate_receipt(message.document)
+    if error:
+        return await message.answer(error)
+
     expire_time, tariff = await get_user_access(user.id)
 
     if not tariff:
         return await message.answer("❌ Сначала выберите уровень доступа!")
 
-    if not message.document.mime_type == 'application/pdf':
-        return await message.answer("❌ Пожалуйста, отправьте PDF-файл чека из Kaspi")
-
-    file_path = os.path.join(RECEIPT_DIR, f"{user.id}_{message.document.file_name}")
-    await bot.download(file=await bot.get_file(message.document.file_id), destination=file_path)
-    receipt_data = await parse_kaspi_receipt(file_path)
-    
-    if not receipt_data:
-        return await message.answer("❌ Не удалось прочитать чек. Убедитесь, что отправлен корректный файл.")
-
-    if await check_duplicate_receipt(
-        check_number=receipt_data.get("check_number"),
-        fp=receipt_data.get("fp"),
-        file_id=message.document.file_id
-    ):
-        return await message.answer("❌ Этот чек уже был загружен ранее")
-
-    errors = []
-    if receipt_data.get("iin") != "620613400018":
-        errors.append("ИИН продавца не совпадает")
-    
-    required_amounts = {
-        "self": 15000,
-        "basic": 100000,
-        "pro": 250000,
-        **{str(y): 15000 for y in range(2025, 2032)}
-    }
-    
-    if receipt_data.get("amount") != required_amounts.get(tariff, 0):
-        errors.append(f"Сумма не соответствует тарифу {tariff}")
-    
-    if errors:
-        return await message.answer("❌ Ошибки в чеке:\n" + "\n".join(errors))
+    if expire_time and expire_time > datetime.now():
+        return await message.answer("❗ У вас уже есть активный доступ!")
 
+    # Чек попадает в хранилище только после всех проверок: отклонённые и повторные
+    # файлы удаляются сразу, а не ждут очистки хранилища.
+    file_path = receipt_store.temp_path()
     try:
-        date_time_str = receipt_data.get("date_time")
-        if not date_time_str:
-            return await message.answer("❌ В чеке отсутствует дата оплаты")
+        error = await download_receipt(bot, message.document, file_path)
+        if error:
+            return await message.answer(error)
+
+        receipt_data = await parse_kaspi_receipt(file_path)
+        if not receipt_data:
+            return await message.answer("❌ Не удалось прочитать чек. Убедитесь, что отправлен корректный файл.")
+
+        receipt_sha256 = await receipt_store.hash_file(file_path)
+
+        if await check_duplicate_receipt(
+            check_number=receipt_data.get("check_number"),
+            fp=receipt_data.get("fp"),
+            file_id=message.document.file_id,
+            receipt_sha256=receipt_sha256
+        ):
+            return await message.answer("❌ Этот чек уже был загружен ранее")
+
+        errors = []
+        if receipt_data.get("iin") != "620613400018":
+            errors.append("ИИН продавца не совпадает")
+        
+        tariff_info = tariffs.catalog.get(tariff)
+        if tariff_info is None or receipt_data.get("amount") != tariff_info.price:
+            errors.append(f"Сумма не соответствует тарифу {tariff}")
+        
+        if errors:
+            return await message.answer("❌ Ошибки в чеке:\n" + "\n".join(errors))
 
-        date_time = datetime.strptime(date_time_str, "%d.%m.%Y %H:%M")
-    except ValueError as e:
-        return await message.answer(f"❌ Ошибка формата даты: {str(e)}")
-    except KeyError:
-        return await message.answer("❌ Не удалось прочитать дату оплаты")
-    
-    if not await save_receipt(
-        user_id=user.id,
-        amount=receipt_data["amount"],
-        check_number=receipt_data["check_number"],
-        fp=receipt_data["fp"],
-        date_time=date_time,
-        buyer_name=receipt_data["buyer_name"],
-        file_id=message.document.file_id
-    ):
-        return await message.answer("❌ Ошибка при сохранении чека")
-
-    duration_map = {
-        "self": 15,
-        "basic": 60,
-        "pro": 180,
-        **{str(y): 15 for y in range(2025, 2032)}
-    }
-    
-    duration_days = duration_map.get(tariff, 7)
+        try:
+            date_time_str = receipt_data.get("date_time")
+            if not date_time_str:
+                return await message.answer("❌ В чеке отсутствует дата оплаты")
+
+            date_time = datetime.strptime(date_time_str, "%d.%m.%Y %H:%M")
+        except ValueError as e:
+            return await message.answer(f"❌ Ошибка формата даты: {str(e)}")
+        except KeyError:
+            return await message.answer("❌ Не удалось прочитать дату оплаты")
+
+        # Запись в БД может проиграть параллельной загрузке того же чека, поэтому файл
+        # переносится в хранилище только после успешного save_receipt.
+        if not await save_receipt(
+            user_id=user.id,
+            amount=receipt_data["amount"],
+            check_number=receipt_data["check_number"],
+            fp=receipt_data["fp"],
+            date_time=date_time,
+            buyer_name=receipt_data["buyer_name"],
+            file_id=message.document.file_id,
+            receipt_sha256=receipt_sha256
+        ):
+            return await message.answer("❌ Ошибка при сохранении чека")
+
+        try:
+            await receipt_store.put(file_path, receipt_sha256)
+        except Exception as e:
+            logging.error("Не удалось сохранить файл чека %s в хранилище: %s", receipt_sha256, e)
+    finally:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+    duration_days = tariff_info.duration_days
     success = await set_user_access(
         user_id=user.id,
         duration_days=duration_days,
@@ -635,58 +1144,45 @@ async def handle_document(message: types.Message, state: FSMContext, bot: Bot):
         f"💳 Уровень: {tariff.upper()}\n"
         f"📝 Файл: {message.document.file_name}"
     )
-    await bot.send_message(ADMIN_ID, info)
-    await bot.send_document(ADMIN_ID, message.document.file_id)
+    admin_notifier.notify("receipt", info, document=message.document.file_id)
     
 @dp.message(F.new_chat_members)
 async def remove_join_message(message: types.Message):
     try:
         await message.delete()
     except Exception as e:
-        logging.warning(f"Не удалось удалить join-сообщение: {e}")
+        logging.warning("Не удалось удалить join-сообщение: %s", e)
 
 @dp.message(F.left_chat_member)
 async def remove_leave_message(message: types.Message):
     try:
         await message.delete()
     except Exception as e:
-        logging.warning(f"Не удалось удалить leave-сообщение: {e}")
-
-GROUP_IDS = [-1002583988789, -1002529607781, -1002611068580, -1002607289832, -1002560662894, -1002645685285, -1002529375771, -1002262602915]  
+        logging.warning("Не удалось удалить leave-сообщение: %s", e)
 
 async def check_access_periodically():
     while True:
         try:
-            expired_users = await get_expired_users()
+            expired_users = await claim_expired_users()
+
+            for user_id, tariff, is_blocked in expired_users:
+                await remove_from_groups(user_id)
 
-            for user_id, tariff in expired_users:
-                await revoke_user_access(user_id)
-                
-                for group_id in GROUP_IDS:
+                if not is_blocked:
                     try:
-                        await bot.ban_chat_member(group_id, user_id) 
-                        await bot.unban_chat_member(group_id, user_id)  
-                        logging.info(f"Пользователь {user_id} удалён из группы {group_id}")
+                        await bot.send_message(user_id, "❌ Ваш доступ истёк. Вы были удалены из группы.")
+                    except TelegramForbiddenError:
+                        await set_user_blocked(user_id, True)
                     except Exception as e:
-                        logging.warning(f"Не удалось удалить пользователя {user_id} из группы {group_id}: {e}")
+                        logging.warning("Не удалось отправить уведомление пользователю %s: %s", user_id, e)
 
-                try:
-                    await bot.send_message(user_id, "❌ Ваш доступ истёк. Вы были удалены из группы.")
-                except Exception as e:
-                    logging.warning(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
-
-                try:
-                    await bot.send_message(
-                        ADMIN_ID,
-                        f"⛔️ Пользователь {user_id} был удалён из групп, доступ истёк ({tariff})."
-                    )
-                except Exception as e:
-                    logging.warning(f"Не удалось отправить уведомление администратору: {e}")
-
-                await revoke_user_access(user_id)
+                admin_notifier.notify(
+                    "expired",
+                    f"⛔️ Пользователь {user_id} был удалён из групп, доступ истёк ({tariff})."
+                )
 
         except Exception as e:
-            logging.error(f"Ошибка в проверке доступа: {e}")
+            logging.error("Ошибка в проверке доступа: %s", e)
 
         await asyncio.sleep(10)
 
@@ -704,10 +1200,6 @@ async def handle_reviews_button(message: types.Message):
 
 @dp.message(F.text == "👤 Мой профиль", F.chat.type == ChatType.PRIVATE)
 async def handle_profile(message: types.Message):
-    global db_pool
-    if not db_pool:
-        db_pool = await create_db_pool()
-
     await save_user(message.from_user)
 
     if db_pool is None:
@@ -717,7 +1209,7 @@ async def handle_profile(message: types.Message):
     expire_time, tariff = await get_user_access(message.from_user.id)
     user = message.from_user
 
-    async with db_pool.acquire() as conn:
+    async with await database.get_db_connection() as conn:
         async with conn.cursor() as cur:
             await cur.execute("SELECT has_reviewed FROM user_access WHERE user_id = %s", (user.id,))
             record = await cur.fetchone()
@@ -746,10 +1238,8 @@ async def handle_profile(message: types.Message):
 
 @dp.message(F.text == "📄 Публичная оферта", F.chat.type == ChatType.PRIVATE)
 async def handle_offer_button(message: types.Message):
-    pdf_path = "oferta.pdf"
     try:
-        document = FSInputFile(pdf_path)
-        await message.answer_document(document)
+        await static_assets.send_document(bot, message.chat.id, OFFER_PATH)
     except Exception as e:
         await message.answer("⚠️ Ошибка при отправке файла: " + str(e))
 
@@ -793,10 +1283,10 @@ async def process_content(message: types.Message, state: FSMContext):
     
     await state.update_data(content=content)
     
-    confirm_kb = ReplyKeyboardBuilder()
-    confirm_kb.button(text="✅ Подтвердить рассылку")
-    confirm_kb.button(text="❌ Отменить")
-    confirm_kb.adjust(2)
+    segment_kb = ReplyKeyboardBuilder()
+    segment_kb.button(text="👥 Все пользователи")
+    segment_kb.button(text="❌ Отменить")
+    segment_kb.adjust(2)
 
     if message.text == "❌ Отменить":
             await state.clear()
@@ -814,10 +1304,44 @@ async def process_content(message: types.Message, state: FSMContext):
         else:
             await message.answer(preview_text)
     except Exception as e:
-        logger.error(f"Ошибка предпросмотра: {e}")
+        logger.error("Ошибка предпросмотра: %s", e)
         return await message.answer("❌ Ошибка при создании предпросмотра")
     
+    await message.answer(SEGMENT_HELP, reply_markup=segment_kb.as_markup(resize_keyboard=True))
+    await state.set_state(BroadcastStates.waiting_segment)
+
+@dp.message(BroadcastStates.waiting_segment)
+async def process_segment(message: types.Message, state: FSMContext):
+    if message.text == "❌ Отменить":
+        await state.clear()
+        await show_main_menu(message, "❌ Рассылка отменена")
+        return
+
+    try:
+        segment = parse_segment(message.text)
+    except ValueError as e:
+        return await message.answer(f"❌ {e}\n\n{SEGMENT_HELP}")
+
+    try:
+        recipients = await count_segment_users(segment)
+    except Exception as e:
+        logger.error("Ошибка подсчёта получателей: %s", e)
+        return await message.answer("❌ Не удалось посчитать получателей")
+
+    if not recipients:
+        return await message.answer("❌ В этом сегменте нет пользователей. Задайте другие условия.")
+
+    await state.update_data(segment=segment)
+
+    confirm_kb = ReplyKeyboardBuilder()
+    confirm_kb.button(text="✅ Подтвердить рассылку")
+    confirm_kb.button(text="⏰ Запланировать")
+    confirm_kb.button(text="❌ Отменить")
+    confirm_kb.adjust(2, 1)
+
     await message.answer(
+        f"👥 Сегмент: {describe_segment(segment)}\n"
+        f"📨 Получателей: {recipients}\n\n"
         "Выберите действие:",
         reply_markup=confirm_kb.as_markup(resize_keyboard=True)
     )
@@ -833,9 +1357,55 @@ async def confirm_broadcast(message: types.Message, state: FSMContext):
     if message.text == "✅ Подтвердить рассылку":
         await send_broadcast(message, state)
         return
+
+    if message.text == "⏰ Запланировать":
+        cancel_kb = ReplyKeyboardBuilder()
+        cancel_kb.button(text="❌ Отменить")
+        await message.answer(
+            "🕒 Когда отправить рассылку? Время по Астане в формате ДД.ММ.ГГГГ ЧЧ:ММ, например "
+            f"{(datetime.now(BROADCAST_TZ) + timedelta(days=1)).strftime('%d.%m.%Y 10:00')}",
+            reply_markup=cancel_kb.as_markup(resize_keyboard=True)
+        )
+        await state.set_state(BroadcastStates.waiting_time)
+        return
     
     await message.answer("Пожалуйста, используйте кнопки для выбора действия")
 
+@dp.message(BroadcastStates.waiting_time)
+async def process_broadcast_time(message: types.Message, state: FSMContext):
+    if message.text == "❌ Отменить":
+        await state.clear()
+        await show_main_menu(message, "❌ Рассылка отменена")
+        return
+
+    try:
+        run_at = datetime.strptime((message.text or "").strip(), "%d.%m.%Y %H:%M").replace(tzinfo=BROADCAST_TZ)
+    except ValueError:
+        return await message.answer("❌ Формат времени: ДД.ММ.ГГГГ ЧЧ:ММ")
+    if run_at <= datetime.now(BROADCAST_TZ):
+        return await message.answer("❌ Это время уже прошло, укажите время в будущем")
+
+    data = await state.get_data()
+    if 'content' not in data:
+        await state.clear()
+        return await message.answer("❌ Ошибка: данные рассылки не найдены", reply_markup=types.ReplyKeyboardRemove())
+
+    try:
+        job_id = await create_scheduled_job(
+            "broadcast", {"content": data['content'], "segment": data.get('segment', {})}, run_at
+        )
+    except Exception as e:
+        logger.error("Ошибка сохранения запланированной рассылки: %s", e)
+        return await message.answer("❌ Не удалось запланировать рассылку")
+
+    await state.clear()
+    await message.answer(
+        f"✅ Рассылка #{job_id} запланирована на {run_at.strftime('%d.%m.%Y %H:%M')}\n"
+        f"👥 Сегмент: {describe_segment(data.get('segment', {}))}\n\n"
+        f"Список: /scheduled, отмена: /cancel_job {job_id}",
+        reply_markup=types.ReplyKeyboardRemove()
+    )
+
 async def show_main_menu(message: types.Message, text: str = None):
     main_kb = ReplyKeyboardBuilder()
     main_kb.button(text="📄 Публичная оферта")
@@ -859,7 +1429,7 @@ async def send_broadcast(message: types.Message, state: FSMContext):
         await state.clear()
         return
  
-    users = await get_all_users()
+    users = await get_segment_users(data.get('segment', {}))
     if not users:
         await message.answer("❌ Нет пользователей для рассылки", reply_markup=types.ReplyKeyboardRemove())
         await state.clear()
@@ -867,121 +1437,227 @@ async def send_broadcast(message: types.Message, state: FSMContext):
    
     progress_msg = await message.answer("🔄 Начинаем рассылку...")
     
-    success = 0
-    errors = 0
     total_users = len(users)
- 
-    for index, user_id in enumerate(users, 1):
+    progress = BroadcastProgress(progress_msg, total_users, BROADCAST_PROGRESS_INTERVAL)
+    progress.start()
+    result = await deliver_broadcast(users, data['content'], DeliveryLog(), progress)
+    await progress.stop()
+
+    success, errors = result["sent"], result["errors"]
+
+    try:
+        await progress_msg.delete()
+    except:
+        pass
+  
+    report_message = (
+        f"📊 Рассылка завершена!\n\n"
+        f"👥 Всего пользователей: {total_users}\n"
+        f"✅ Успешно отправлено: {success}\n"
+        f"❌ Ошибок: {errors}\n"
+        f"🚫 Заблокировали бота: {result['blocked']}\n"
+        f"📈 Успешных доставок: {int(success/total_users*100)}%\n\n"
+        f"🧾 Журнал: /deliveries {result['delivery_log']}"
+    )
+
+    await message.answer(report_message, reply_markup=types.ReplyKeyboardRemove())
+    await state.clear()
+
+async def deliver_content(user_id: int, content: dict):
+    # Отправка через общий ограничитель скорости; на 429 ждём столько, сколько просит Telegram.
+    for attempt in range(3):
+        await broadcast_limiter.wait()
         try:
-            content = data['content']
-      
             if content.get('photo'):
-                await bot.send_photo(
+                return await bot.send_photo(
                     chat_id=user_id,
                     photo=content['photo'],
                     caption=content.get('text', ''),
                     parse_mode='HTML'
                 )
             elif content.get('video'):
-                await bot.send_video(
+                return await bot.send_video(
                     chat_id=user_id,
                     video=content['video'],
                     caption=content.get('text', ''),
                     parse_mode='HTML'
                 )
             elif content.get('document'):
-                await bot.send_document(
+                return await bot.send_document(
                     chat_id=user_id,
                     document=content['document'],
                     caption=content.get('text', ''),
                     parse_mode='HTML'
                 )
             else:
-                await bot.send_message(
+                return await bot.send_message(
                     chat_id=user_id,
                     text=content.get('text', ''),
                     parse_mode='HTML'
                 )
-            
-            success += 1
-       
-            if index % 10 == 0 or index == total_users:
-                progress = int(index / total_users * 100)
-                await progress_msg.edit_text(
-                    f"🔄 Рассылка в процессе...\n"
-                    f"📊 Прогресс: {progress}%\n"
-                    f"✅ Успешно: {success}\n"
-                    f"❌ Ошибок: {errors}"
-                )
-                
+        except TelegramRetryAfter as e:
+            if attempt == 2:
+                raise
+            await asyncio.sleep(e.retry_after)
+
+async def deliver_broadcast(users, content: dict, delivery_log: DeliveryLog, progress: BroadcastProgress = None) -> dict:
+    # Общий цикл доставки для рассылки из меню и запланированной: журнал доставок,
+    # счётчики прогресса и пометка заблокировавших бота пользователей.
+    blocked = []
+    sent = errors = 0
+    for user_id in users:
+        started = time.perf_counter()
+        try:
+            await deliver_content(user_id, content)
+            sent += 1
+            delivery_log.record(user_id, "sent", latency_ms=int((time.perf_counter() - started) * 1000))
+        except TelegramForbiddenError as e:
+            errors += 1
+            blocked.append(user_id)
+            delivery_log.record(user_id, "blocked", type(e).__name__, int((time.perf_counter() - started) * 1000))
         except Exception as e:
             errors += 1
-            logger.error(f"Ошибка отправки пользователю {user_id}: {str(e)}")
-         
-            await asyncio.sleep(1)
-  
+            delivery_log.record(user_id, "error", type(e).__name__, int((time.perf_counter() - started) * 1000))
+            logger.error("Ошибка отправки пользователю %s: %s", user_id, e, extra={"sample_every": 50})
+        if progress is not None:
+            progress.sent, progress.errors = sent, errors
+
     try:
-        await progress_msg.delete()
-    except:
-        pass
-  
-    report_message = (
-        f"📊 Рассылка завершена!\n\n"
-        f"👥 Всего пользователей: {total_users}\n"
-        f"✅ Успешно отправлено: {success}\n"
-        f"❌ Ошибок: {errors}\n"
-        f"📈 Успешных доставок: {int(success/total_users*100)}%"
-    )
+        await mark_users_blocked(blocked)
+    except Exception as e:
+        logger.error("Не удалось отметить заблокировавших бота пользователей: %s", e)
+    await delivery_log.close()
+    return {"total": len(users), "sent": sent, "errors": errors, "blocked": len(blocked),
+            "delivery_log": delivery_log.job_id}
 
-    await message.answer(report_message, reply_markup=types.ReplyKeyboardRemove())
-    await state.clear()
+async def execute_scheduled_broadcast(job_id: int, payload: dict) -> dict:
+    users = await get_segment_users(payload.get('segment', {}))
+    return await deliver_broadcast(users, payload['content'], DeliveryLog(job_id=f"job{job_id}"))
 
-async def execute_scheduled_broadcast(content: dict):
-    users = await get_all_users()
-    for user_id in users:
-        try:
-            if content['photo']:
-                await bot.send_photo(user_id, content['photo'], caption=content['text'])
-            elif content['video']:
-                await bot.send_video(user_id, content['video'], caption=content['text'])
-            elif content['document']:
-                await bot.send_document(user_id, content['document'], caption=content['text'])
-            else:
-                await bot.send_message(user_id, content['text'])
-        except Exception as e:
-            logger.error(f"Scheduled broadcast error: {str(e)}")
+async def complete_scheduled_job(job_id: int, status: str, result: dict):
+    try:
+        await finish_scheduled_job(job_id, status, result)
+    except Exception as e:
+        logger.error("Не удалось сохранить статус %s задания #%s: %s", status, job_id, e)
+
+async def run_scheduled_job(job_id: int, kind: str, payload: dict):
+    try:
+        if kind != "broadcast":
+            raise ValueError(f"Неизвестный тип задания: {kind}")
+        result = await execute_scheduled_broadcast(job_id, payload)
+    except asyncio.CancelledError:
+        logger.warning("Задание #%s прервано остановкой бота", job_id)
+        await complete_scheduled_job(job_id, "interrupted", {"error": "бот остановлен во время выполнения"})
+        admin_notifier.notify("scheduled", f"⚠️ Запланированная рассылка #{job_id} прервана остановкой бота")
+        raise
+    except Exception as e:
+        logger.error("Ошибка выполнения задания #%s: %s", job_id, e)
+        await complete_scheduled_job(job_id, "failed", {"error": str(e)})
+        admin_notifier.notify("scheduled", f"❌ Запланированная рассылка #{job_id} не выполнена: {e}")
+        return
+
+    await complete_scheduled_job(job_id, "done", result)
+    admin_notifier.notify(
+        "scheduled",
+        f"📊 Запланированная рассылка #{job_id} завершена: {result['sent']} из {result['total']} доставлено, "
+        f"ошибок {result['errors']}, заблокировали бота {result['blocked']}.\n"
+        f"🧾 Журнал: /deliveries {result['delivery_log']}"
+    )
+
+async def poll_scheduled_jobs():
+    # Вызывается планировщиком; каждое задание выполняется отдельной задачей,
+    # чтобы длинная рассылка не задерживала следующие опросы.
+    try:
+        for job_id in await interrupt_stale_jobs(SCHEDULED_STALE_HOURS):
+            logger.warning("Задание #%s не завершилось за %s ч и помечено прерванным", job_id, SCHEDULED_STALE_HOURS)
+            admin_notifier.notify("scheduled", f"⚠️ Запланированная рассылка #{job_id} зависла и помечена прерванной")
+        jobs = await claim_due_jobs()
+    except Exception as e:
+        logger.warning("Не удалось получить запланированные задания: %s", e)
+        return
+    for job_id, kind, payload in jobs:
+        logger.info("Запуск запланированного задания #%s (%s)", job_id, kind)
+        task = asyncio.create_task(run_scheduled_job(job_id, kind, payload))
+        scheduled_runs.add(task)
+        task.add_done_callback(scheduled_runs.discard)
+
+@dp.my_chat_member(F.chat.type == ChatType.PRIVATE)
+async def handle_bot_membership(update: types.ChatMemberUpdated):
+    status = update.new_chat_member.status
+    try:
+        if status == ChatMemberStatus.KICKED:
+            await set_user_blocked(update.from_user.id, True)
+        elif status == ChatMemberStatus.MEMBER:
+            await set_user_blocked(update.from_user.id, False)
+    except Exception as e:
+        logging.error("Ошибка обновления статуса блокировки %s: %s", update.from_user.id, e)
 
 @dp.message(F.chat.type.in_({ChatType.GROUP, ChatType.SUPERGROUP}))
 async def ignore_group_messages(message: types.Message):
     pass  
 
+register_reviews_handlers(dp, bot)
+
 async def delete_bot_commands():
-    await bot.delete_my_commands(scope=BotCommandScopeAllPrivateChats())
-   
-    await bot.delete_my_commands()
-    
-async def on_startup(bot: Bot): 
-    global db_pool
-    db_pool = await create_db_pool() 
-    await init_db(db_pool)  
-    setup_reviews(dp, bot, db_pool) 
-    await delete_bot_commands()
-    scheduler.start()
+    try:
+        await bot.delete_my_commands(scope=BotCommandScopeAllPrivateChats())
+        await bot.delete_my_commands()
+    except Exception as e:
+        logging.warning("Не удалось удалить команды бота: %s", e)
 
-async def main():
+def log_startup_report():
+    stages = ", ".join(f"{name} {ms:.0f} мс" for name, ms in startup_timings.items())
+    total = (time.perf_counter() - STARTED_AT) * 1000
+    logger.info("Бот готов к работе за %.0f мс (%s)", total, stages)
+
+async def on_startup(bot: Bot):
     global db_pool
-    db_pool = await create_db_pool()
-    await init_db(db_pool)
-    setup_reviews(dp, bot, db_pool)
-    asyncio.create_task(check_access_periodically())
+    with startup_stage("пул БД"):
+        db_pool = await create_db_pool()
+    with startup_stage("схема БД"):
+        await init_db(db_pool)
+    with startup_stage("тарифы"):
+        try:
+            await tariffs.load_catalog()
+        except Exception as e:
+            logger.error("Не удалось загрузить тарифы, используются тарифы по умолчанию: %s", e)
+
+    scheduler.add_job(ensure_fiscal_partitions, "cron", hour=3, id="fiscal_partitions", replace_existing=True)
+    scheduler.add_job(poll_scheduled_jobs, "interval", seconds=SCHEDULED_POLL_INTERVAL, id="scheduled_jobs", replace_existing=True)
+    scheduler.add_job(receipt_store.compact, "interval", hours=RECEIPT_COMPACT_INTERVAL, id="receipt_compactor", replace_existing=True)
+    scheduler.add_job(idempotency.cleanup, "interval", hours=1, id="processed_updates_cleanup", replace_existing=True)
+    scheduler.start()
+    admin_notifier.start()
+    loop_watchdog.start()
+    background_tasks.append(asyncio.create_task(check_access_periodically()))
+    background_tasks.append(asyncio.create_task(review_publisher(bot)))
+    background_tasks.append(asyncio.create_task(db_health_probe()))
+    background_tasks.append(asyncio.create_task(delete_bot_commands()))
+    # Первая задача заставляет пул запустить воркеры сразу, а не при первом чеке.
+    warm_up = asyncio.get_running_loop().run_in_executor(get_parse_executor(), receipt_parser.warm_up)
+    warm_up.add_done_callback(log_parser_warm_up)
+
+    log_startup_report()
 
 async def on_shutdown():
+    for task in background_tasks:
+        task.cancel()
     scheduler.shutdown()
-    if db_pool:
-        await db_pool.close()
+    # Прерванные рассылки отмечают свой статус, пока пул БД ещё открыт.
+    for task in scheduled_runs:
+        task.cancel()
+    await asyncio.gather(*scheduled_runs, return_exceptions=True)
+    await callback_tasks.stop()
+    loop_watchdog.stop()
+    await profiler.aclose()
+    await admin_notifier.stop()
+    if parse_executor:
+        parse_executor.shutdown(wait=False, cancel_futures=True)
+    await close_db_pool()
     await bot.session.close()
 
 if __name__ == '__main__':
+    startup_timings["импорт"] = (time.perf_counter() - STARTED_AT) * 1000
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
     asyncio.run(dp.start_polling(bot))
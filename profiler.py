@@ -0,0 +1,175 @@
+import asyncio
+import cProfile
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+from loop_watchdog import handler_label
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = 0.005
+
+
+class HandlerStats:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class ProfileReport:
+    def __init__(self, started: float, finished: float, updates: int, handlers: dict,
+                 pstats_data: bytes, collapsed: bytes, samples: int):
+        self.duration = finished - started
+        self.updates = updates
+        self.handlers = handlers
+        self.pstats_data = pstats_data
+        self.collapsed = collapsed
+        self.samples = samples
+
+    def summary(self, limit: int = 10) -> str:
+        lines = [
+            f"🔬 Профилирование: {self.duration:.1f} сек, апдейтов {self.updates}, сэмплов стека {self.samples}",
+            "",
+        ]
+        ranked = sorted(self.handlers.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+        for label, stats in ranked:
+            lines.append(
+                f"• {label}: {stats.count} раз, всего {stats.total * 1000:.0f} мс, "
+                f"в среднем {stats.total / stats.count * 1000:.1f} мс, максимум {stats.max * 1000:.0f} мс"
+            )
+        if not ranked:
+            lines.append("Апдейтов за время профилирования не было")
+        return "\n".join(lines)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+# Профилировщик включается командой /profile на время или на N апдейтов. Пока он выключен,
+# middleware только проверяет флаг. Во время сеанса работают cProfile (файл pstats) и
+# сэмплирующий поток, который раз в SAMPLE_INTERVAL снимает стек потока цикла событий и
+# складывает его в формат collapsed stacks с обработчиком в корне (для flamegraph).
+class HandlerProfiler:
+    def __init__(self):
+        self.active = False
+        self._on_finish = None
+        self._remaining = None
+        self._timer = None
+        self._labels = {}
+
+    async def middleware(self, handler, event, data):
+        if not self.active:
+            return await handler(event, data)
+
+        label = handler_label(event, data)
+        task = asyncio.current_task()
+        self._labels[task] = label
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            self._labels.pop(task, None)
+            if self.active:
+                stats = self._handlers.get(label)
+                if stats is None:
+                    stats = self._handlers[label] = HandlerStats()
+                stats.count += 1
+                stats.total += elapsed
+                stats.max = max(stats.max, elapsed)
+                self._updates += 1
+                if self._remaining is not None:
+                    self._remaining -= 1
+                    if self._remaining <= 0:
+                        self.stop()
+
+    def start(self, on_finish, seconds: float = None, updates: int = None):
+        if self.active:
+            raise RuntimeError("Профилирование уже запущено")
+        self._on_finish = on_finish
+        self._remaining = updates
+        self._handlers = {}
+        self._updates = 0
+        self._stacks = Counter()
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, args=(self._stopped, self._stacks),
+                                         name="profiler-sampler", daemon=True)
+        self._profile = cProfile.Profile()
+        self._started = time.monotonic()
+        self.active = True
+        self._profile.enable()
+        self._sampler.start()
+        if seconds:
+            self._timer = self._loop.call_later(seconds, self.stop)
+        logger.info("Профилирование запущено (секунд: %s, апдейтов: %s)", seconds, updates)
+
+    def _sample(self, stopped: threading.Event, stacks: Counter):
+        while not stopped.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            try:
+                task = asyncio.current_task(self._loop)
+            except RuntimeError:
+                task = None
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            names.append(self._labels.get(task, "цикл событий"))
+            stacks[";".join(reversed(names))] += 1
+
+    def stop(self) -> Optional[asyncio.Task]:
+        # Сэмплирующий поток только получает сигнал остановки: дожидается его и собирает
+        # отчёт отдельная задача, чтобы join не блокировал цикл событий. Задача возвращается.
+        if not self.active:
+            return None
+        self.active = False
+        self._profile.disable()
+        self._stopped.set()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        session = (self._sampler, self._profile, self._started, time.monotonic(),
+                   self._updates, self._handlers, self._stacks)
+        self._profile = None
+        on_finish, self._on_finish = self._on_finish, None
+        task = asyncio.get_running_loop().create_task(self._finish(on_finish, *session))
+        task.add_done_callback(_log_failure)
+        return task
+
+    async def aclose(self):
+        # При остановке бота отчёт отправляется до закрытия сессии бота.
+        task = self.stop()
+        if task is not None:
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _finish(self, on_finish, sampler, profile, started, finished, updates, handlers, stacks):
+        await asyncio.to_thread(sampler.join)
+        profile.create_stats()
+        collapsed = "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+        report = ProfileReport(
+            started, finished, updates, handlers,
+            marshal.dumps(profile.stats), collapsed.encode(), sum(stacks.values())
+        )
+        logger.info("Профилирование завершено: %s апдейтов", report.updates)
+        if on_finish is not None:
+            await on_finish(report)
+
+
+def _log_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error("Не удалось отправить отчёт профилирования: %s", task.exception())
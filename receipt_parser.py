@@ -0,0 +1,48 @@
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# pdfplumber (и pdfminer под ним) импортируется только в воркерах парсинга,
+# чтобы не замедлять запуск бота.
+
+AMOUNT_RE = re.compile(r"(\d+)\s*₸")
+IIN_RE = re.compile(r"ИИН/БИН продавца\s*(\d+)")
+CHECK_NUMBER_RE = re.compile(r"№ чека\s*(\S+)")
+FP_RE = re.compile(r"ФП\s*(\d+)")
+DATE_TIME_RE = re.compile(r"Дата и время\s*(?:по Астане)?\s*(\d{2}\.\d{2}\.\d{4} \d{2}:\d{2})")
+BUYER_NAME_RE = re.compile(r"ФИО покупателя\s*(.+)")
+
+
+def warm_up():
+    import pdfplumber  # noqa: F401
+    return True
+
+
+def extract_receipt_fields(text: str) -> dict:
+    def group(pattern):
+        match = pattern.search(text)
+        return match.group(1) if match else None
+
+    amount = group(AMOUNT_RE)
+    buyer_name = group(BUYER_NAME_RE)
+    return {
+        "amount": float(amount) if amount else None,
+        "iin": group(IIN_RE),
+        "check_number": group(CHECK_NUMBER_RE),
+        "fp": group(FP_RE),
+        "date_time": group(DATE_TIME_RE),
+        "buyer_name": buyer_name.strip() if buyer_name else None
+    }
+
+
+def parse_kaspi_receipt_file(pdf_path):
+    import pdfplumber
+
+    try:
+        with pdfplumber.open(pdf_path) as pdf:
+            text = "\n".join(page.extract_text() or "" for page in pdf.pages)
+            return extract_receipt_fields(text)
+    except Exception as e:
+        logger.error("Ошибка парсинга PDF: %s", e)
+        return None
@@ -0,0 +1,171 @@
+import asyncio
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import Optional
+from database import get_referenced_receipt_hashes
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 65536
+
+# Расширение файла определяет, как он сжат, поэтому смена RECEIPT_COMPRESSION
+# не мешает читать уже сохранённые чеки.
+EXTENSIONS = {"zstd": ".pdf.zst", "gzip": ".pdf.gz", "none": ".pdf"}
+
+
+def _open_writer(path: str, compression: str):
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=10).stream_writer(open(path, "wb"), closefd=True)
+    if compression == "gzip":
+        return gzip.open(path, "wb", compresslevel=6)
+    return open(path, "wb")
+
+
+def _open_reader(path: str):
+    if path.endswith(".zst"):
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+# Чеки хранятся по SHA-256 содержимого в каталогах objects/ab/cd/: одинаковые файлы
+# занимают место один раз, а путь к чеку вычисляется по хэшу без поиска.
+class ReceiptStore:
+    def __init__(self, root: str, compression: str = "gzip", retention_days: int = 365,
+                 orphan_grace_days: int = 7):
+        if compression == "zstd" and zstandard is None:
+            logger.warning("Пакет zstandard не установлен, чеки будут сжиматься gzip")
+            compression = "gzip"
+        if compression not in EXTENSIONS:
+            logger.warning("Неизвестный формат сжатия %s, используется gzip", compression)
+            compression = "gzip"
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.compression = compression
+        self.retention = retention_days * 86400
+        self.orphan_grace = orphan_grace_days * 86400
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def temp_path(self) -> str:
+        # Имя временного файла не зависит от имени, присланного пользователем.
+        return os.path.join(self.tmp_dir, f"{uuid.uuid4().hex}.pdf")
+
+    def _shard(self, sha256: str) -> str:
+        return os.path.join(self.objects_dir, sha256[:2], sha256[2:4])
+
+    def path_for(self, sha256: str) -> Optional[str]:
+        shard = self._shard(sha256)
+        for extension in EXTENSIONS.values():
+            path = os.path.join(shard, sha256 + extension)
+            if os.path.exists(path):
+                return path
+        return None
+
+    @staticmethod
+    def _hash(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    async def hash_file(self, path: str) -> str:
+        return await asyncio.to_thread(self._hash, path)
+
+    def _put(self, source: str, sha256: Optional[str]) -> str:
+        if sha256 is None:
+            sha256 = self._hash(source)
+
+        if self.path_for(sha256):
+            os.remove(source)
+            return sha256
+
+        shard = self._shard(sha256)
+        os.makedirs(shard, exist_ok=True)
+        destination = os.path.join(shard, sha256 + EXTENSIONS[self.compression])
+        partial = f"{destination}.{uuid.uuid4().hex}.part"
+        try:
+            with open(source, "rb") as src, _open_writer(partial, self.compression) as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            os.replace(partial, destination)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        os.remove(source)
+        return sha256
+
+    async def put(self, source: str, sha256: Optional[str] = None) -> str:
+        # Переносит файл в хранилище (исходный файл удаляется) и возвращает его SHA-256.
+        # Уже посчитанный hash_file хэш можно передать, чтобы не читать файл повторно.
+        return await asyncio.to_thread(self._put, source, sha256)
+
+    def read(self, sha256: str) -> Optional[bytes]:
+        path = self.path_for(sha256)
+        if path is None:
+            return None
+        with _open_reader(path) as f:
+            return f.read()
+
+    def _scan(self, now: float):
+        expired, candidates = [], {}
+        for shard in os.scandir(self.objects_dir):
+            if not shard.is_dir():
+                continue
+            for subshard in os.scandir(shard.path):
+                if not subshard.is_dir():
+                    continue
+                for entry in os.scandir(subshard.path):
+                    age = now - entry.stat().st_mtime
+                    if entry.name.endswith(".part"):
+                        if age > 3600:
+                            expired.append(entry.path)
+                    elif age > self.retention:
+                        expired.append(entry.path)
+                    elif age > self.orphan_grace:
+                        candidates[entry.name.split(".", 1)[0]] = entry.path
+
+        for entry in os.scandir(self.tmp_dir):
+            if now - entry.stat().st_mtime > 3600:
+                expired.append(entry.path)
+        return expired, candidates
+
+    @staticmethod
+    def _remove(paths):
+        removed = 0
+        for path in paths:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    async def compact(self, batch_size: int = 1000):
+        # Удаляются чеки старше срока хранения, незавершённые и временные файлы,
+        # а также файлы, на которые за orphan_grace так и не сослалась ни одна запись fiscal_checks.
+        expired, candidates = await asyncio.to_thread(self._scan, time.time())
+
+        orphans = []
+        hashes = list(candidates)
+        for start in range(0, len(hashes), batch_size):
+            batch = hashes[start:start + batch_size]
+            referenced = await get_referenced_receipt_hashes(batch)
+            orphans.extend(candidates[sha256] for sha256 in batch if sha256 not in referenced)
+
+        removed = await asyncio.to_thread(self._remove, expired + orphans)
+        if removed:
+            logger.info("Архив чеков очищен: удалено файлов %s (устаревших %s, без записи %s)", removed, len(expired), len(orphans))
+        return removed
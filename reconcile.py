@@ -0,0 +1,151 @@
+import argparse
+import asyncio
+import csv
+import io
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from log_setup import setup_logging
+
+setup_logging()
+
+import receipt_parser
+from database import close_db_pool, create_db_pool, get_archived_receipts_page
+from receipt_store import ReceiptStore
+
+logger = logging.getLogger("reconcile")
+
+RECEIPT_DATE_FORMAT = "%d.%m.%Y %H:%M"
+REPORT_HEADER = ("id", "user_id", "created_at", "receipt_sha256", "status", "field", "db_value", "parsed_value")
+
+# Хранилище открывается в каждом воркере один раз: воркер сам читает и распаковывает файл,
+# в основной процесс возвращаются только разобранные поля.
+_store = None
+
+
+def _init_worker(root: str):
+    global _store
+    _store = ReceiptStore(root)
+    receipt_parser.warm_up()
+
+
+def _reparse(sha256: str):
+    data = _store.read(sha256)
+    if data is None:
+        return "missing_file", None
+    fields = receipt_parser.parse_kaspi_receipt_file(io.BytesIO(data))
+    if fields is None:
+        return "parse_failed", None
+    return "ok", fields
+
+
+def _same_amount(db_value, parsed) -> bool:
+    if db_value is None or parsed is None:
+        return db_value is None and parsed is None
+    try:
+        return Decimal(db_value) == Decimal(str(parsed))
+    except InvalidOperation:
+        return False
+
+
+def _same_date(db_value, parsed) -> bool:
+    if db_value is None or parsed is None:
+        return db_value is None and parsed is None
+    try:
+        return db_value == datetime.strptime(parsed, RECEIPT_DATE_FORMAT)
+    except ValueError:
+        return False
+
+
+def diff_receipt(row, fields: dict):
+    # Возвращает [(поле, значение в БД, значение из файла)] для расходящихся полей.
+    _, _, amount, check_number, fp, date_time, _, _ = row
+    mismatches = []
+    if not _same_amount(amount, fields.get("amount")):
+        mismatches.append(("amount", amount, fields.get("amount")))
+    if check_number != fields.get("check_number"):
+        mismatches.append(("check_number", check_number, fields.get("check_number")))
+    if fp != fields.get("fp"):
+        mismatches.append(("fp", fp, fields.get("fp")))
+    if not _same_date(date_time, fields.get("date_time")):
+        mismatches.append(("date_time", date_time, fields.get("date_time")))
+    return mismatches
+
+
+async def reconcile(root: str, output: str, workers: int, since: datetime, page_size: int):
+    loop = asyncio.get_running_loop()
+    stats = {"checked": 0, "ok": 0, "mismatch": 0, "parse_failed": 0, "missing_file": 0}
+    started = time.monotonic()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(root,)) as pool, \
+            open(output, "w", encoding="utf-8", newline="") as report_file:
+        report = csv.writer(report_file)
+        report.writerow(REPORT_HEADER)
+
+        # Следующая страница читается из БД, пока воркеры разбирают текущую.
+        next_page = asyncio.ensure_future(get_archived_receipts_page(since, 0, page_size))
+        while True:
+            rows = await next_page
+            if not rows:
+                break
+            last = rows[-1]
+            next_page = asyncio.ensure_future(get_archived_receipts_page(last[7], last[0], page_size))
+
+            results = await asyncio.gather(*(loop.run_in_executor(pool, _reparse, row[6]) for row in rows))
+            for row, (status, fields) in zip(rows, results):
+                receipt_id, user_id, *_, sha256, created_at = row
+                stats["checked"] += 1
+                if status != "ok":
+                    stats[status] += 1
+                    report.writerow((receipt_id, user_id, created_at, sha256, status, "", "", ""))
+                    continue
+                mismatches = diff_receipt(row, fields)
+                if not mismatches:
+                    stats["ok"] += 1
+                    continue
+                stats["mismatch"] += 1
+                for field, db_value, parsed_value in mismatches:
+                    report.writerow((receipt_id, user_id, created_at, sha256, "mismatch", field, db_value, parsed_value))
+
+            elapsed = time.monotonic() - started
+            logger.info("Проверено чеков: %s (%.1f чек/сек)", stats["checked"], stats["checked"] / elapsed)
+
+    elapsed = time.monotonic() - started
+    stats["seconds"] = round(elapsed, 1)
+    stats["per_second"] = round(stats["checked"] / elapsed, 1) if elapsed else 0
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Повторный разбор архива чеков и сверка с fiscal_checks")
+    parser.add_argument("--since", type=lambda value: datetime.strptime(value, "%Y-%m-%d"),
+                        default=datetime(2000, 1, 1), help="сверять чеки, загруженные начиная с даты ГГГГ-ММ-ДД")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="число процессов разбора")
+    parser.add_argument("--page-size", type=int, default=500, help="строк fiscal_checks за один запрос")
+    parser.add_argument("--output", default=f"reconcile_{datetime.now():%Y%m%d_%H%M%S}.csv", help="файл отчёта")
+    args = parser.parse_args()
+
+    root = os.environ.get("RECEIPT_DIR", "/app/receipts")
+    await create_db_pool()
+    try:
+        stats = await reconcile(root, args.output, args.workers, args.since, args.page_size)
+    finally:
+        await close_db_pool()
+
+    logger.info(
+        "Сверка завершена за %s сек (%s чек/сек): проверено %s, совпало %s, расхождений %s, "
+        "не разобрано %s, нет файла %s. Отчёт: %s",
+        stats["seconds"], stats["per_second"], stats["checked"], stats["ok"], stats["mismatch"],
+        stats["parse_failed"], stats["missing_file"], args.output
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,9 +1,15 @@
+import asyncio
 import logging
+import os
+import database
 from aiogram import types, F
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from datetime import datetime, timedelta
+from callbacks import (
+    callback_router, StartReviewCb, CancelReviewCb, SkipMediaCb, ApproveReviewCb, RejectReviewCb
+)
 
 class ReviewStates(StatesGroup):
     waiting_review_text = State()
@@ -12,21 +18,21 @@ class ReviewStates(StatesGroup):
 REVIEWS_CHANNEL_ID = -1002513508156
 ADMIN_ID = 957724800
 MIN_REVIEW_INTERVAL = timedelta(minutes=5)
+REVIEW_PUBLISH_INTERVAL = float(os.environ.get('REVIEW_PUBLISH_INTERVAL', 3))
+REVIEW_QUEUE_POLL = 30
 
-db_pool = None
+publish_wakeup = asyncio.Event()
 
-def register_reviews_handlers(dp, bot, pool):
-    global db_pool
-    db_pool = pool
-
-    @dp.callback_query(F.data == "start_review")
+def register_reviews_handlers(dp, bot):
+    @callback_router.route(StartReviewCb, ack=True)
     async def start_review(call: types.CallbackQuery, state: FSMContext):
+        pool = database.db_pool
         if pool is None:
-            await call.answer("Произошла ошибка инициализации базы данных. Пожалуйста, попробуйте позже.", show_alert=True)
+            await call.message.answer("Произошла ошибка инициализации базы данных. Пожалуйста, попробуйте позже.")
             logging.error("db_pool was None in start_review handler.")
             return
 
-        async with pool.acquire() as conn:
+        async with await database.get_db_connection() as conn:
             async with conn.cursor() as cur:
                 await cur.execute("""
                     SELECT has_reviewed
@@ -37,7 +43,7 @@ def register_reviews_handlers(dp, bot, pool):
                 has_reviewed = row[0] if row else False
 
         if has_reviewed:
-            await call.answer("❌ Вы уже оставили отзыв!", show_alert=True)
+            await call.message.answer("❌ Вы уже оставили отзыв!")
             return
 
         user = call.from_user
@@ -50,7 +56,7 @@ def register_reviews_handlers(dp, bot, pool):
             last_time_dt = datetime.fromisoformat(last_time)
             if now - last_time_dt < MIN_REVIEW_INTERVAL:
                 remaining = (MIN_REVIEW_INTERVAL - (now - last_time_dt)).seconds // 60
-                await call.answer(f"⏳ Подождите {remaining} мин. перед повторной отправкой.", show_alert=True)
+                await call.message.answer(f"⏳ Подождите {remaining} мин. перед повторной отправкой.")
                 return
 
         await state.update_data(user_id=user.id, username=user.username, last_review_time=now.isoformat())
@@ -58,16 +64,15 @@ def register_reviews_handlers(dp, bot, pool):
         await call.message.answer(
             "✍️ Напишите ваш отзыв (максимум 500 символов):",
             reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[[InlineKeyboardButton(text="❌ Отменить", callback_data="cancel_review")]]
+                inline_keyboard=[[InlineKeyboardButton(text="❌ Отменить", callback_data=CancelReviewCb().pack())]]
             )
         )
         await state.set_state(ReviewStates.waiting_review_text)
 
-    @dp.callback_query(F.data == "cancel_review")
+    @callback_router.route(CancelReviewCb, ack=True)
     async def cancel_review(call: types.CallbackQuery, state: FSMContext):
         await state.clear()
         await call.message.edit_text("❌ Отзыв отменён.")
-        await call.answer()
 
     @dp.message(ReviewStates.waiting_review_text)
     async def process_review_text(message: types.Message, state: FSMContext):
@@ -78,7 +83,7 @@ def register_reviews_handlers(dp, bot, pool):
         await message.answer(
             "📎 Хотите прикрепить фото или видео?\nОтправьте файл или нажмите 👇",
             reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[[InlineKeyboardButton(text="➡️ Пропустить", callback_data="skip_media")]]
+                inline_keyboard=[[InlineKeyboardButton(text="➡️ Пропустить", callback_data=SkipMediaCb().pack())]]
             )
         )
         await state.set_state(ReviewStates.waiting_review_media)
@@ -94,53 +99,110 @@ def register_reviews_handlers(dp, bot, pool):
         await message.answer("✅ Отзыв отправлен на модерацию!")
         await state.clear()
 
-    @dp.callback_query(F.data == "skip_media")
+    @callback_router.route(SkipMediaCb, ack=True)
     async def skip_media(call: types.CallbackQuery, state: FSMContext):
         try:
             
             await call.message.delete()
         except Exception as e:
-            logging.error(f"Ошибка удаления сообщения: {e}")
+            logging.error("Ошибка удаления сообщения: %s", e)
 
         await send_review_to_admin(bot, state)
         await call.message.answer("✅ Отзыв отправлен на модерацию!")
         await state.clear()
 
-    @dp.callback_query(F.data.startswith("approve_review_"))
-    async def approve_review(call: types.CallbackQuery):
-        user_id = int(call.data.split("_")[2])
+    # Результат модерации виден по ответу на сообщение с отзывом: callback уже подтверждён.
+    @callback_router.route(ApproveReviewCb, ack=True)
+    async def approve_review(call: types.CallbackQuery, callback_data: ApproveReviewCb):
+        review_id = callback_data.review_id
+        if not review_id:
+            review_id = await store_legacy_review(call.message, callback_data.user_id)
 
-        async with db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute("""
-                    UPDATE user_access 
-                    SET has_reviewed = TRUE 
-                    WHERE user_id = %s
-                """, (user_id,))
-        
-        await bot.send_message(user_id, "🎉 Ваш отзыв был одобрен!")
+        if await database.approve_review(review_id) is None:
+            await call.message.reply("Отзыв уже обработан.")
+            return
+
+        publish_wakeup.set()
+        await call.message.edit_reply_markup(reply_markup=None)
+        await call.message.reply("✅ Отзыв одобрен и поставлен в очередь на публикацию.")
 
-        text = call.message.caption or call.message.text or ""
-        review_text = text.split("\n\n", 1)[-1].strip()
+    @callback_router.route(RejectReviewCb, ack=True)
+    async def reject_review(call: types.CallbackQuery, callback_data: RejectReviewCb):
+        review_id = callback_data.review_id
+        if not review_id:
+            review_id = await store_legacy_review(call.message, callback_data.user_id)
 
-        if call.message.photo:
-            await bot.send_photo(REVIEWS_CHANNEL_ID, call.message.photo[-1].file_id,
-                                 caption=f"🌟 Новый отзыв!\n\n{review_text}")
-        elif call.message.video:
-            await bot.send_video(REVIEWS_CHANNEL_ID, call.message.video.file_id,
-                                 caption=f"🌟 Новый отзыв!\n\n{review_text}")
-        else:
-            await bot.send_message(REVIEWS_CHANNEL_ID, f"🌟 Новый отзыв!\n\n{review_text}")
+        user_id = await database.reject_review(review_id)
+        if user_id is None:
+            await call.message.reply("Отзыв уже обработан.")
+            return
 
         await call.message.edit_reply_markup(reply_markup=None)
-        await call.answer("Отзыв одобрен и опубликован.")
+        await call.message.reply("❌ Отзыв отклонён.")
+        try:
+            await bot.send_message(user_id, "😔 Ваш отзыв был отклонён.")
+        except Exception as e:
+            logging.warning("Не удалось уведомить пользователя %s об отклонении отзыва: %s", user_id, e)
+
+async def store_legacy_review(message: types.Message, user_id: int) -> int:
+    # Отзывы, отправленные на модерацию до появления таблицы reviews, есть только в подписи.
+    text = message.caption or message.text or ""
+    review_text = text.split("\n\n", 1)[-1].strip()
+    if message.photo:
+        media_id, media_type = message.photo[-1].file_id, "photo"
+    elif message.video:
+        media_id, media_type = message.video.file_id, "video"
+    else:
+        media_id, media_type = None, None
+    return await database.create_legacy_review(
+        message.chat.id, message.message_id, user_id, review_text, media_id, media_type
+    )
 
-    @dp.callback_query(F.data.startswith("reject_"))
-    async def reject_review(call: types.CallbackQuery):
-        user_id = int(call.data.split("_")[1])
-        await bot.send_message(user_id, "😔 Ваш отзыв был отклонён.")
-        await call.message.edit_reply_markup(reply_markup=None)
-        await call.answer("Отзыв отклонён.")
+async def publish_review(bot, review):
+    review_id, user_id, text, media_id, media_type = review
+    post = f"🌟 Новый отзыв!\n\n{text}"
+
+    if media_type == "photo":
+        await bot.send_photo(REVIEWS_CHANNEL_ID, media_id, caption=post)
+    elif media_type == "video":
+        await bot.send_video(REVIEWS_CHANNEL_ID, media_id, caption=post)
+    else:
+        await bot.send_message(REVIEWS_CHANNEL_ID, post)
+    await database.set_review_status(review_id, "published")
+
+    try:
+        await bot.send_message(user_id, "🎉 Ваш отзыв был одобрен!")
+    except Exception as e:
+        logging.warning("Не удалось уведомить пользователя %s об одобрении отзыва: %s", user_id, e)
+
+async def review_publisher(bot):
+    # Одобренные отзывы публикуются в канал по одному, не чаще раза в REVIEW_PUBLISH_INTERVAL.
+    while True:
+        try:
+            review = await database.claim_review_for_publishing()
+        except Exception as e:
+            logging.error("Ошибка получения отзыва из очереди: %s", e)
+            review = None
+
+        if review is None:
+            publish_wakeup.clear()
+            try:
+                await asyncio.wait_for(publish_wakeup.wait(), REVIEW_QUEUE_POLL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        try:
+            await publish_review(bot, review)
+        except Exception as e:
+            # Неудачный отзыв не должен блокировать очередь: он остаётся в истории как 'failed'.
+            logging.error("Ошибка публикации отзыва %s: %s", review[0], e)
+            try:
+                await database.set_review_status(review[0], "failed")
+            except Exception as e:
+                logging.error("Не удалось обновить статус отзыва %s: %s", review[0], e)
+
+        await asyncio.sleep(REVIEW_PUBLISH_INTERVAL)
 
 async def send_review_to_admin(bot, state: FSMContext):
     data = await state.get_data()
@@ -150,10 +212,12 @@ async def send_review_to_admin(bot, state: FSMContext):
     media_id = data.get("media_id")
     media_type = data.get("media_type")
 
+    review_id = await database.create_review(user_id, data.get("username"), text, media_id, media_type)
+
     caption = f"📨 Отзыв от пользователя:\n🆔 ID: {user_id}\n👤 Username: @{username}\n\n{text}"
     kb = InlineKeyboardMarkup(inline_keyboard=[[
-        InlineKeyboardButton(text="✅ Одобрить", callback_data=f"approve_review_{user_id}"),
-        InlineKeyboardButton(text="❌ Отклонить", callback_data=f"reject_{user_id}")
+        InlineKeyboardButton(text="✅ Одобрить", callback_data=ApproveReviewCb(review_id=review_id, user_id=user_id).pack()),
+        InlineKeyboardButton(text="❌ Отклонить", callback_data=RejectReviewCb(review_id=review_id, user_id=user_id).pack())
     ]])
 
     if media_type == "photo":
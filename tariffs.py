@@ -0,0 +1,113 @@
+import logging
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Optional
+from database import get_tariffs, insert_tariffs
+
+logger = logging.getLogger(__name__)
+
+LEVEL = "level"
+YEAR = "year"
+
+
+@dataclass(frozen=True)
+class Tariff:
+    code: str
+    label: str
+    price: int
+    duration_days: int
+    chat_id: Optional[int] = None
+    kind: str = LEVEL
+    sort_order: int = 0
+
+
+# Начальное содержимое таблицы tariffs; дальше тарифы правятся в БД и подхватываются /reload_tariffs.
+DEFAULT_TARIFFS = (
+    Tariff("self", "САМОСТОЯТЕЛЬНЫЙ", 15000, 15, None, LEVEL, 10),
+    Tariff("basic", "БАЗОВЫЙ", 100000, 60, -1002583988789, LEVEL, 20),
+    Tariff("pro", "ПРО", 250000, 180, None, LEVEL, 30),
+    Tariff("2025", "Год 2025", 15000, 15, -1002529607781, YEAR, 2025),
+    Tariff("2026", "Год 2026", 15000, 15, -1002611068580, YEAR, 2026),
+    Tariff("2027", "Год 2027", 15000, 15, -1002607289832, YEAR, 2027),
+    Tariff("2028", "Год 2028", 15000, 15, -1002560662894, YEAR, 2028),
+    Tariff("2029", "Год 2029", 15000, 15, -1002645685285, YEAR, 2029),
+    Tariff("2030", "Год 2030", 15000, 15, -1002529375771, YEAR, 2030),
+    Tariff("2031", "Год 2031", 15000, 15, -1002262602915, YEAR, 2031),
+)
+
+
+def validate_tariff(tariff: Tariff):
+    # Код попадает в callback_data, а код тарифа-года ещё и в YearCb(year=int(code)).
+    if not tariff.code or len(tariff.code) > 20 or ":" in tariff.code:
+        raise ValueError(f"некорректный код тарифа «{tariff.code}»")
+    if not tariff.label:
+        raise ValueError(f"у тарифа {tariff.code} нет названия")
+    if tariff.kind not in (LEVEL, YEAR):
+        raise ValueError(f"неизвестный вид тарифа {tariff.code}: {tariff.kind}")
+    if tariff.kind == YEAR and not tariff.code.isdigit():
+        raise ValueError(f"код тарифа-года должен быть годом: «{tariff.code}»")
+    if tariff.price < 0 or tariff.duration_days <= 0:
+        raise ValueError(f"некорректная цена или срок у тарифа {tariff.code}")
+
+
+def format_price(price: int) -> str:
+    return f"{price:,}".replace(",", " ")
+
+
+def format_days(days: int) -> str:
+    if days % 10 == 1 and days % 100 != 11:
+        return f"{days} день"
+    if 2 <= days % 10 <= 4 and not 12 <= days % 100 <= 14:
+        return f"{days} дня"
+    return f"{days} дней"
+
+
+# Каталог не меняется после создания: перезагрузка собирает новый и подменяет
+# ссылку catalog целиком, поэтому обработчики никогда не видят его наполовину обновлённым.
+class TariffCatalog:
+    def __init__(self, tariffs):
+        ordered = sorted(tariffs, key=lambda tariff: (tariff.sort_order, tariff.code))
+        self.tariffs = MappingProxyType({tariff.code: tariff for tariff in ordered})
+        self.levels = tuple(tariff for tariff in ordered if tariff.kind == LEVEL)
+        self.years = tuple(tariff for tariff in ordered if tariff.kind == YEAR)
+        self.chat_ids = tuple(dict.fromkeys(tariff.chat_id for tariff in ordered if tariff.chat_id))
+
+    def __len__(self):
+        return len(self.tariffs)
+
+    def __contains__(self, code):
+        return code in self.tariffs
+
+    def get(self, code) -> Optional[Tariff]:
+        return self.tariffs.get(code)
+
+    def label(self, code: str) -> str:
+        tariff = self.tariffs.get(code)
+        return tariff.label if tariff else code.upper()
+
+    def codes(self) -> str:
+        return ", ".join(self.tariffs)
+
+
+catalog = TariffCatalog(DEFAULT_TARIFFS)
+
+
+async def load_catalog() -> TariffCatalog:
+    global catalog
+    rows = await get_tariffs()
+    if not rows:
+        await insert_tariffs([
+            (tariff.code, tariff.label, tariff.price, tariff.duration_days, tariff.chat_id, tariff.kind, tariff.sort_order)
+            for tariff in DEFAULT_TARIFFS
+        ])
+        logger.info("Таблица tariffs заполнена тарифами по умолчанию")
+        catalog = TariffCatalog(DEFAULT_TARIFFS)
+        return catalog
+
+    # Одна некорректная строка отменяет всю загрузку: остаётся прежний каталог.
+    loaded = [Tariff(*row) for row in rows]
+    for tariff in loaded:
+        validate_tariff(tariff)
+    catalog = TariffCatalog(loaded)
+    logger.info("Каталог тарифов загружен: %s", catalog.codes())
+    return catalog
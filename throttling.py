@@ -0,0 +1,107 @@
+import logging
+import os
+import time
+from aiogram import BaseMiddleware, types
+from aiogram.enums import ChatType
+from callbacks import get_route_flag
+
+logger = logging.getLogger(__name__)
+
+
+def _limit_from_env(name: str, default: str):
+    # Формат: "<количество>/<секунды>", например "3/60".
+    value = os.environ.get(name, default)
+    try:
+        count, seconds = value.split("/", 1)
+        return int(count), float(seconds)
+    except ValueError:
+        logger.warning("Некорректное значение %s=%s, используется %s", name, value, default)
+        count, seconds = default.split("/", 1)
+        return int(count), float(seconds)
+
+
+THROTTLE_LIMITS = {
+    "receipt": _limit_from_env("THROTTLE_RECEIPT", "3/60"),
+    "materials": _limit_from_env("THROTTLE_MATERIALS", "3/60"),
+    "default": _limit_from_env("THROTTLE_DEFAULT", "30/60"),
+}
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated", "warned")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.warned = False
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, limits: dict = None, exempt_ids=(), sweep_interval: float = 60.0):
+        self.limits = limits or THROTTLE_LIMITS
+        self.exempt_ids = frozenset(exempt_ids)
+        self.sweep_interval = sweep_interval
+        self._buckets = {}
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    def _sweep(self, now: float):
+        # Корзина, простоявшая дольше полного восстановления, ничем не отличается от новой.
+        expired = []
+        for key, bucket in self._buckets.items():
+            capacity, period = self.limits[key[1]]
+            if now - bucket.updated >= period:
+                expired.append(key)
+        for key in expired:
+            del self._buckets[key]
+        self._next_sweep = now + self.sweep_interval
+
+    # Возвращает 0, если запрос разрешён, иначе сколько секунд подождать.
+    def consume(self, user_id: int, handler_class: str) -> float:
+        capacity, period = self.limits[handler_class]
+        rate = capacity / period
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+        key = (user_id, handler_class)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(capacity, now)
+        else:
+            bucket.tokens = min(capacity, bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.warned = False
+            return 0
+        return (1 - bucket.tokens) / rate
+
+    async def __call__(self, handler, event, data):
+        # Ограничиваются только личные чаты: в группах бот не должен отвечать предупреждениями.
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        if user is None or user.id in self.exempt_ids or chat is None or chat.type != ChatType.PRIVATE:
+            return await handler(event, data)
+
+        handler_class = get_route_flag(data, "throttle", "default")
+        if handler_class not in self.limits:
+            handler_class = "default"
+
+        wait = self.consume(user.id, handler_class)
+        if not wait:
+            return await handler(event, data)
+
+        text = f"⏳ Слишком много запросов. Попробуйте через {int(wait) + 1} сек."
+        try:
+            if isinstance(event, types.CallbackQuery):
+                await event.answer(text)
+            else:
+                bucket = self._buckets.get((user.id, handler_class))
+                if bucket is not None and not bucket.warned:
+                    bucket.warned = True
+                    await event.answer(text)
+        except Exception as e:
+            logger.warning("Не удалось отправить предупреждение об ограничении: %s", e)
+        logger.info("Запрос пользователя %s (%s) отклонён ограничителем", user.id, handler_class)
+        return None